@@ -0,0 +1,204 @@
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from matrix_store import replace_atomically
+from ranking import select_top_k
+
+# Default recall/latency knobs for the IVF index
+N_LISTS: int = 256
+N_PROBE: int = 8
+PROJECTION_DIM: int = 64
+KMEANS_ITERATIONS: int = 10
+KMEANS_SAMPLE_SIZE: int = 50_000
+ASSIGN_BLOCK_SIZE: int = 8_192
+
+
+@dataclass(frozen=True, slots=True)
+class IVFIndex:
+    # Gaussian projection from the sparse feature space to a small dense space
+    projection: np.ndarray
+    # Unit-length coarse centroids in the projected space
+    centroids: np.ndarray
+    # Track ids grouped by list; list i is list_items[list_offsets[i]:list_offsets[i + 1]]
+    list_offsets: np.ndarray
+    list_items: np.ndarray
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+
+def _unit_rows(array: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(array, axis=1, keepdims=True)
+    return np.divide(array, norms, out=np.zeros_like(array), where=norms > 0)
+
+
+def project_rows(normalized, projection: np.ndarray) -> np.ndarray:
+    return _unit_rows(np.asarray(normalized @ projection, dtype=np.float32))
+
+
+def _assign_lists(embedded: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # Blocked argmax keeps the (rows x lists) score block bounded in memory
+    assignments = np.empty(embedded.shape[0], dtype=np.int32)
+    for start in range(0, embedded.shape[0], ASSIGN_BLOCK_SIZE):
+        block = embedded[start : start + ASSIGN_BLOCK_SIZE]
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _spherical_kmeans(
+    embedded: np.ndarray,
+    n_lists: int,
+    n_iter: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    centroids = embedded[rng.choice(embedded.shape[0], n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign_lists(embedded, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, embedded)
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        # Reseed empty lists from random points so every list stays usable
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = embedded[rng.choice(embedded.shape[0], int(empty.sum()))]
+        centroids = _unit_rows(sums)
+    return centroids
+
+
+def build_ivf_index(
+    normalized,
+    n_lists: int = N_LISTS,
+    dim: int = PROJECTION_DIM,
+    n_iter: int = KMEANS_ITERATIONS,
+    sample_size: int = KMEANS_SAMPLE_SIZE,
+    seed: int = 42,
+) -> IVFIndex:
+    rng = np.random.default_rng(seed)
+    n_items, n_features = normalized.shape
+    n_lists = min(n_lists, n_items)
+
+    projection = rng.standard_normal((n_features, dim), dtype=np.float32) / np.sqrt(dim)
+    embedded = project_rows(normalized, projection)
+
+    # Fit the coarse quantizer on a sample, then assign every track
+    sample = rng.choice(n_items, min(sample_size, n_items), replace=False)
+    centroids = _spherical_kmeans(embedded[sample], n_lists, n_iter, rng)
+    assignments = _assign_lists(embedded, centroids)
+
+    list_items = np.argsort(assignments, kind="stable").astype(np.int32)
+    list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+
+    logging.info(f"Built IVF index with {n_lists} lists over {n_items} tracks (dim={dim})")
+    return IVFIndex(projection, centroids, list_offsets, list_items)
+
+
+def add_to_ivf_index(index: IVFIndex, normalized_rows, first_id: int) -> IVFIndex:
+    # New tracks join their nearest existing list; the quantizer is not refit
+    embedded = project_rows(normalized_rows, index.projection)
+    new_assignments = _assign_lists(embedded, index.centroids)
+    old_assignments = np.repeat(np.arange(index.n_lists), np.diff(index.list_offsets))
+
+    assignments = np.concatenate([old_assignments, new_assignments])
+    items = np.concatenate(
+        [
+            index.list_items,
+            np.arange(first_id, first_id + len(new_assignments), dtype=np.int32),
+        ]
+    )
+    order = np.argsort(assignments, kind="stable")
+
+    list_offsets = np.zeros(index.n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=index.n_lists), out=list_offsets[1:])
+    return IVFIndex(index.projection, index.centroids, list_offsets, items[order])
+
+
+def save_ivf_index(index: IVFIndex, path: Path) -> None:
+    with replace_atomically(path) as scratch:
+        np.savez(
+            scratch,
+            projection=index.projection,
+            centroids=index.centroids,
+            list_offsets=index.list_offsets,
+            list_items=index.list_items,
+        )
+    logging.info(f"IVF index saved to {path}")
+
+
+def load_ivf_index(path: Path) -> IVFIndex:
+    with np.load(path) as arrays:
+        return IVFIndex(
+            arrays["projection"],
+            arrays["centroids"],
+            arrays["list_offsets"],
+            arrays["list_items"],
+        )
+
+
+def probe_ivf_lists(
+    index: IVFIndex,
+    normalized,
+    query_idx: int,
+    n_probe: int = N_PROBE,
+) -> np.ndarray:
+    # Members of the n_probe lists whose centroids are closest to the query
+    query_embedded = project_rows(normalized[query_idx], index.projection).ravel()
+    probed, _ = select_top_k(index.centroids @ query_embedded, n_probe)
+    return np.concatenate(
+        [index.list_items[index.list_offsets[i] : index.list_offsets[i + 1]] for i in probed]
+    )
+
+
+def search_ivf_index(
+    index: IVFIndex,
+    normalized,
+    query_idx: int,
+    k: int,
+    n_probe: int = N_PROBE,
+    exclude: Optional[int] = None,
+    mask: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Probe the closest lists, then rescore their members exactly; a boolean
+    # mask over the catalog drops disallowed members before rescoring
+    candidates = probe_ivf_lists(index, normalized, query_idx, n_probe)
+    if mask is not None:
+        candidates = candidates[mask[candidates]]
+    scores = normalized[candidates] @ normalized[query_idx].toarray().ravel()
+
+    exclude_pos = None
+    if exclude is not None:
+        hits = np.flatnonzero(candidates == exclude)
+        exclude_pos = int(hits[0]) if hits.size else None
+    positions, top_scores = select_top_k(scores, k, exclude=exclude_pos)
+    return candidates[positions].astype(np.intp), top_scores
+
+
+def recall_at_k(
+    index: IVFIndex,
+    normalized,
+    k: int = 10,
+    n_probe: int = N_PROBE,
+    n_queries: int = 200,
+    seed: int = 42,
+) -> Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(normalized.shape[0], min(n_queries, normalized.shape[0]), replace=False)
+
+    hits = 0
+    expected = 0
+    for query_idx in queries:
+        exact_scores = normalized @ normalized[query_idx].toarray().ravel()
+        exact, _ = select_top_k(exact_scores, k, exclude=query_idx)
+        approx, _ = search_ivf_index(index, normalized, query_idx, k, n_probe, exclude=query_idx)
+        hits += np.intersect1d(exact, approx).size
+        expected += exact.size
+
+    recall = hits / expected if expected else 0.0
+    logging.info(f"IVF recall@{k} with n_probe={n_probe}: {recall:.3f}")
+    return {"k": k, "n_probe": n_probe, "n_queries": len(queries), "recall": recall}
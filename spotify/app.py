@@ -1,9 +1,22 @@
+import os
 import streamlit as st
-from content_filtering import content_recommendation
-from scipy.sparse import load_npz
-import pandas as pd
-from numpy import load
-import time
+from cache import ResultCache, model_version
+from catalog import DISPLAY_COLS, load_catalog
+from content_filtering import Paths, get_top_k_recommendations, load_neighbour_table
+from instrumentation import configure_logging
+from lookup import load_or_build_song_index
+from matrix_store import load_csr_arrays
+from service import RecommenderClient
+from serving import load_current_bundle
+from suggestions import build_artist_suggestions, build_song_suggestions
+
+# When set, the UI is a thin client of the HTTP service (service.py) and loads
+# no artifacts itself
+SERVICE_URL = os.environ.get("RECOMMENDER_SERVICE_URL")
+# Optional directory for a result cache shared by every app process
+CACHE_DIR = os.environ.get("RECOMMENDER_CACHE_DIR")
+paths = Paths()
+configure_logging()
 
 # Page config
 st.set_page_config(
@@ -210,54 +223,126 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Load the data
-@st.cache_data
-def load_data():
-    cleaned_data_path = "../data/processed/cleaned_data.csv"
-    songs_data = pd.read_csv(cleaned_data_path)
+# The prebuilt serving bundle (serving.py), if current; it replaces the
+# individual loads below with one memory-mapped read
+@st.cache_resource
+def load_bundle(version):
+    return load_current_bundle(paths)
+
+# Load the data once per process and model version; cache_resource shares the
+# objects instead of pickling them per session, which would copy the
+# memory-mapped matrix. A rebuilt model changes the version and forces a reload.
+@st.cache_resource
+def load_data(version):
+    bundle = load_bundle(version)
+    if bundle is not None:
+        return bundle.catalog, bundle.matrix
+
+    # Only the display columns are read from the columnar catalog
+    songs_data = load_catalog(paths.cleaned_catalog, columns=DISPLAY_COLS)
     
-    transformed_data_path = "../models/transformed_data.npz"
-    transformed_data = load_npz(transformed_data_path)
+    # Rows are L2-normalized at training time, so scoring is a plain mat-vec.
+    # The CSR arrays are memory-mapped so all workers share one page-cache copy
+    transformed_data = load_csr_arrays(paths.normalized_arrays)
     
     return songs_data, transformed_data
 
-# Function to get artist suggestions
-def get_artist_suggestions(partial_name, songs_data, limit=10):
-    if not partial_name or len(partial_name) < 2:
-        return []
-    
-    partial_name = partial_name.lower().strip()
-    matching_artists = songs_data[songs_data['artist'].str.lower().str.contains(partial_name, na=False, regex=False)]['artist'].unique()
-    
-    # Sort by relevance (exact starts first, then contains)
-    exact_starts = [artist for artist in matching_artists if artist.lower().startswith(partial_name)]
-    contains = [artist for artist in matching_artists if not artist.lower().startswith(partial_name)]
-    
-    # Combine and limit results
-    all_matches = exact_starts + contains
-    return list(set(all_matches))[:limit]
+# Build the (name, artist) lookup once per process, reusing the persisted copy
+@st.cache_resource
+def load_song_index(version):
+    bundle = load_bundle(version)
+    if bundle is not None:
+        return bundle.song_index
+    songs_data, _ = load_data(version)
+    return load_or_build_song_index(songs_data, paths.song_index, paths.cleaned_catalog)
+
+# Build the ranked artist/song suggestion indexes once per process
+@st.cache_resource
+def load_suggestion_indexes(version):
+    bundle = load_bundle(version)
+    if bundle is not None:
+        return bundle.artist_suggestions, bundle.song_suggestions
+    songs_data, _ = load_data(version)
+    return build_artist_suggestions(songs_data), build_song_suggestions(songs_data)
+
+# Offline top-K neighbours, if built; every k the selectbox offers is a slice
+@st.cache_resource
+def load_neighbours(version):
+    bundle = load_bundle(version)
+    if bundle is not None:
+        return bundle.neighbour_table
+    _, transformed_data = load_data(version)
+    return load_neighbour_table(paths.neighbour_table, transformed_data.shape[0])
+
+# Recommendation and suggestion results, shared by all sessions of this process
+@st.cache_resource
+def load_result_cache():
+    return ResultCache(paths.model_artifacts, disk_dir=CACHE_DIR)
+
+# Function to get artist suggestions (exact-prefix matches first, then substrings)
+def get_artist_suggestions(partial_name, limit=10):
+    if client is not None:
+        return client.suggest_artists(partial_name, limit=limit)
+    return result_cache.get_or_compute(
+        ("artists", partial_name.lower().strip(), limit),
+        lambda: artist_suggestion_index.suggest(partial_name, limit=limit)
+    )
 
 # Function to get song suggestions for a specific artist
-def get_song_suggestions(partial_song, artist_name, songs_data, limit=10):
-    if not partial_song or len(partial_song) < 2:
-        return []
-    
-    partial_song = partial_song.lower().strip()
-    artist_name = artist_name.lower().strip()
-    
-    # Filter songs by artist first, then by song name
-    artist_songs = songs_data[songs_data['artist'].str.lower() == artist_name]
-    matching_songs = artist_songs[artist_songs['name'].str.lower().str.contains(partial_song, na=False, regex=False)]['name'].unique()
-    
-    # Sort by relevance
-    exact_starts = [song for song in matching_songs if song.lower().startswith(partial_song)]
-    contains = [song for song in matching_songs if not song.lower().startswith(partial_song)]
-    
-    all_matches = exact_starts + contains
-    return list(set(all_matches))[:limit]
+def get_song_suggestions(partial_song, artist_name, limit=10):
+    if client is not None:
+        return client.suggest_songs(partial_song, artist_name, limit=limit)
+    return result_cache.get_or_compute(
+        ("songs", partial_song.lower().strip(), artist_name.lower().strip(), limit),
+        lambda: song_suggestion_index.suggest(partial_song, limit=limit, scope=artist_name)
+    )
+
+def artist_exists(artist_name):
+    # Song suggestions are scoped by artist, so the service returns none for
+    # unknown artists and needs no separate check
+    return client is not None or song_index.has_artist(artist_name)
+
+# Returns None when the song is not in the catalog
+def get_recommendations(song_name, artist_name, k):
+    if client is not None:
+        return client.recommend(song_name, artist_name, k)
+    query_idx = song_index.find(song_name, artist_name)
+    if query_idx is None:
+        return None
+    return result_cache.get_or_compute(
+        ("recommend", query_idx, k),
+        lambda: get_top_k_recommendations(
+            query_name=song_name,
+            query_artist=artist_name,
+            raw_df=songs_data,
+            features_matrix=transformed_data,
+            top_k=k,
+            normalized=True,
+            song_index=song_index,
+            neighbour_table=neighbour_table
+        )
+    )
 
-# Load data with caching
-songs_data, transformed_data = load_data()
+def get_song_preview(song_name, artist_name):
+    # Preview of the queried song itself; the service only returns neighbours
+    if client is not None:
+        return None
+    query_idx = song_index.find(song_name, artist_name)
+    if query_idx is None:
+        return None
+    return songs_data['spotify_preview_url'].iloc[query_idx]
+
+# Load data with caching, unless a recommendation service does the work
+if SERVICE_URL:
+    client = RecommenderClient(SERVICE_URL)
+else:
+    client = None
+    version = model_version(paths.model_artifacts)
+    songs_data, transformed_data = load_data(version)
+    song_index = load_song_index(version)
+    neighbour_table = load_neighbours(version)
+    artist_suggestion_index, song_suggestion_index = load_suggestion_indexes(version)
+    result_cache = load_result_cache()
 
 # Header
 st.markdown("""
@@ -282,7 +367,7 @@ with col2:
     
     # Show artist suggestions if partial input is provided
     if artist_name and len(artist_name.strip()) >= 2:
-        artist_suggestions = get_artist_suggestions(artist_name, songs_data)
+        artist_suggestions = get_artist_suggestions(artist_name)
         
         if artist_suggestions and artist_name.lower().strip() not in [artist.lower() for artist in artist_suggestions]:
             st.markdown(f"""
@@ -309,8 +394,8 @@ with col2:
     # Show song suggestions if both artist and partial song name are provided
     if artist_name and song_name and len(song_name.strip()) >= 2:
         # Check if artist exists exactly
-        if artist_name.lower().strip() in [artist.lower() for artist in songs_data['artist'].unique()]:
-            song_suggestions = get_song_suggestions(song_name, artist_name, songs_data)
+        if artist_exists(artist_name):
+            song_suggestions = get_song_suggestions(song_name, artist_name)
             
             if song_suggestions and song_name.lower().strip() not in [song.lower() for song in song_suggestions]:
                 st.markdown(f"""
@@ -346,44 +431,38 @@ with col2:
         
         # Search button
         if st.button('🚀 Get Recommendations'):
+            # Loading animation
+            with st.spinner('🎵 Finding your perfect playlist...'):
+                recommendations = get_recommendations(song_name_lower, artist_name_lower, k)
+
             # Check if song exists
-            if ((songs_data["name"] == song_name_lower) & (songs_data['artist'] == artist_name_lower)).any():
-                
-                # Loading animation
-                with st.spinner('🎵 Finding your perfect playlist...'):
-                    time.sleep(1)  # Simulate processing time
-                    
-                    recommendations = content_recommendation(
-                        song_name=song_name_lower,
-                        artist_name=artist_name_lower,
-                        songs_data=songs_data,
-                        transformed_data=transformed_data,
-                        k=k
-                    )
+            if recommendations is not None:
                 
                 st.success(f'🎉 Found {len(recommendations)} amazing recommendations!')
                 
+                # The queried song is excluded from its recommendations, so
+                # the card shows it and the list starts at the first result
+                st.markdown(f"""
+                <div class="recommendation-card current-playing">
+                    <h2 style="color: #4ecdc4; margin-bottom: 0.5rem;">🎵 Currently Playing</h2>
+                    <h3 style="color: white; margin-bottom: 1rem;">{song_name.title()} by {artist_name.title()}</h3>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                preview_url = get_song_preview(song_name_lower, artist_name_lower)
+                if preview_url:
+                    st.audio(preview_url)
+                
                 # Display recommendations
                 for ind, recommendation in recommendations.iterrows():
                     rec_song_name = recommendation['name'].title()
                     rec_artist_name = recommendation['artist'].title()
                     
                     if ind == 0:
-                        st.markdown(f"""
-                        <div class="recommendation-card current-playing">
-                            <h2 style="color: #4ecdc4; margin-bottom: 0.5rem;">🎵 Currently Playing</h2>
-                            <h3 style="color: white; margin-bottom: 1rem;">{rec_song_name} by {rec_artist_name}</h3>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        if recommendation['spotify_preview_url']:
-                            st.audio(recommendation['spotify_preview_url'])
-                        
-                    elif ind == 1:
                         st.markdown(f"""
                         <div class="recommendation-card next-up">
                             <h3 style="color: #45b7d1; margin-bottom: 0.5rem;">⏭️ Next Up</h3>
-                            <h4 style="color: white; margin-bottom: 1rem;">{ind}. {rec_song_name} by {rec_artist_name}</h4>
+                            <h4 style="color: white; margin-bottom: 1rem;">{ind + 1}. {rec_song_name} by {rec_artist_name}</h4>
                         </div>
                         """, unsafe_allow_html=True)
                         
@@ -393,7 +472,7 @@ with col2:
                     else:
                         st.markdown(f"""
                         <div class="recommendation-card">
-                            <h4 style="color: white; margin-bottom: 1rem;">{ind}. {rec_song_name} by {rec_artist_name}</h4>
+                            <h4 style="color: white; margin-bottom: 1rem;">{ind + 1}. {rec_song_name} by {rec_artist_name}</h4>
                         </div>
                         """, unsafe_allow_html=True)
                         
@@ -0,0 +1,610 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz
+
+from catalog import DISPLAY_COLS, load_catalog
+from content_filtering import (
+    Paths,
+    get_top_k_recommendations,
+    normalize_rows,
+    train_feature_transformer,
+    transform_dataset,
+    transform_in_chunks,
+)
+from data_cleaning import preprocess_tracks, prune_for_content_filtering
+from diversity import Diversity
+from filters import (
+    ATTRIBUTE_COLS,
+    TrackFilter,
+    build_attribute_index,
+    load_attribute_index,
+)
+from instrumentation import configure_logging
+from lookup import build_song_index, load_song_index
+from matrix_store import load_csr_arrays
+from ranking import select_top_k
+from suggestions import build_artist_suggestions, build_song_suggestions
+
+CATALOG_SIZES: List[int] = [10_000, 50_000, 250_000, 1_000_000]
+K_VALUES: List[int] = [5, 10, 20, 100]
+
+# Catalog sizes for the end-to-end suite, shaped like Music Info.csv
+PIPELINE_SIZES: List[int] = [10_000, 100_000, 1_000_000]
+N_QUERIES: int = 200
+# Relative slowdown of a latency metric that counts as a regression
+REGRESSION_TOLERANCE: float = 0.2
+
+MODELS_DIR = Path(__file__).resolve().parents[1] / "models"
+
+TAG_VOCABULARY: List[str] = [
+    "rock",
+    "pop",
+    "indie",
+    "electronic",
+    "alternative",
+    "jazz",
+    "metal",
+    "folk",
+    "hip_hop",
+    "soul",
+    "punk",
+    "blues",
+    "country",
+    "dance",
+    "ambient",
+    "experimental",
+    "classic_rock",
+    "hard_rock",
+    "singer_songwriter",
+    "instrumental",
+    "rnb",
+    "reggae",
+    "funk",
+    "house",
+    "techno",
+    "emo",
+    "grunge",
+    "psychedelic",
+    "lo_fi",
+    "chillout",
+]
+WORDS: List[str] = [
+    "love",
+    "night",
+    "heart",
+    "dream",
+    "fire",
+    "blue",
+    "summer",
+    "rain",
+    "light",
+    "road",
+    "time",
+    "home",
+    "wild",
+    "dance",
+    "gold",
+    "lonely",
+    "river",
+    "star",
+    "ghost",
+    "city",
+]
+
+
+def time_call(fn: Callable[[], object], repeats: int = 20) -> float:
+    # Median wall time in milliseconds
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def latency_stats(timings_ms: Sequence[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(timings_ms, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def measure(fn: Callable[[], object]) -> Tuple[object, Dict[str, float]]:
+    # One-shot wall time and the peak of Python/NumPy allocations made by fn
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": seconds, "peak_mb": peak / 2**20}
+
+
+def synthetic_catalog(n_tracks: int, seed: int = 42, duplicate_rate: float = 0.02) -> pd.DataFrame:
+    # Same columns as Music Info.csv; artist popularity is Zipf-like, a few
+    # track ids repeat and some tags/genres are missing, as in the real file
+    rng = np.random.default_rng(seed)
+    n_artists = max(n_tracks // 5, 1)
+    artist_ids = (rng.zipf(1.3, n_tracks) - 1) % n_artists
+    n_unique = max(int(n_tracks * (1 - duplicate_rate)), 1)
+    track_ids = rng.permutation(
+        np.concatenate([np.arange(n_unique), rng.integers(0, n_unique, n_tracks - n_unique)])
+    )
+
+    words = np.array(WORDS)
+    names = pd.Series(words[rng.integers(0, len(words), n_tracks)]).str.cat(
+        [
+            pd.Series(words[rng.integers(0, len(words), n_tracks)]),
+            pd.Series(np.arange(n_tracks).astype(str)),
+        ],
+        sep=" ",
+    )
+    tags = np.array(TAG_VOCABULARY)
+    tag_lists = [
+        ", ".join(tags[rng.choice(len(tags), rng.integers(1, 6), replace=False)])
+        for _ in range(n_tracks)
+    ]
+
+    df = pd.DataFrame(
+        {
+            "track_id": np.char.add("TR", np.char.zfill(track_ids.astype(str), 10)),
+            "name": names.str.title(),
+            "artist": np.char.add("Artist ", artist_ids.astype(str)),
+            "spotify_preview_url": np.char.add("https://p.scdn.co/mp3/", track_ids.astype(str)),
+            "spotify_id": np.char.add("sp", track_ids.astype(str)),
+            "tags": tag_lists,
+            "genre": rng.choice(["Rock", "Pop", "Electronic", "Jazz", None], n_tracks),
+            "year": rng.integers(1950, 2023, n_tracks),
+            "duration_ms": rng.integers(60_000, 600_000, n_tracks),
+            "danceability": rng.random(n_tracks),
+            "energy": rng.random(n_tracks),
+            "key": rng.integers(0, 12, n_tracks),
+            "loudness": rng.normal(-8, 4, n_tracks),
+            "mode": rng.integers(0, 2, n_tracks),
+            "speechiness": rng.random(n_tracks),
+            "acousticness": rng.random(n_tracks),
+            "instrumentalness": rng.random(n_tracks),
+            "liveness": rng.random(n_tracks),
+            "valence": rng.random(n_tracks),
+            "tempo": rng.normal(120, 25, n_tracks),
+            "time_signature": rng.choice([1, 3, 4, 5], n_tracks, p=[0.02, 0.1, 0.85, 0.03]),
+        }
+    )
+    df.loc[rng.random(n_tracks) < 0.1, "tags"] = None
+    return df
+
+
+def synthetic_history(
+    track_ids: np.ndarray,
+    n_users: int,
+    plays_per_user: int = 50,
+    seed: int = 42,
+) -> pd.DataFrame:
+    # Same columns as User Listening History.csv with Zipf-like track popularity
+    rng = np.random.default_rng(seed)
+    n_rows = n_users * plays_per_user
+    popularity = (rng.zipf(1.2, n_rows) - 1) % len(track_ids)
+    return pd.DataFrame(
+        {
+            "track_id": np.asarray(track_ids)[popularity],
+            "user_id": np.char.add("user_", rng.integers(0, n_users, n_rows).astype(str)),
+            "playcount": rng.geometric(0.3, n_rows),
+        }
+    )
+
+
+def write_synthetic_data(n_tracks: int, out_dir: Path, n_users: Optional[int] = None) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    catalog = synthetic_catalog(n_tracks)
+    catalog.to_csv(out_dir / "Music Info.csv", index=False)
+    history = synthetic_history(catalog["track_id"].unique(), n_users or max(n_tracks // 10, 1))
+    history.to_csv(out_dir / "User Listening History.csv", index=False)
+    logging.info(f"Wrote {len(catalog):,} tracks and {len(history):,} plays to {out_dir}")
+
+
+def argsort_top_k(scores: np.ndarray, k: int, exclude: int) -> List[int]:
+    # The original get_top_k_recommendations ranking path
+    ranked_indices = np.argsort(scores.ravel())[::-1]
+    return [i for i in ranked_indices if i != exclude][:k]
+
+
+def bench_top_k(
+    catalog_sizes: Sequence[int] = CATALOG_SIZES,
+    k_values: Sequence[int] = K_VALUES,
+    repeats: int = 20,
+    seed: int = 42,
+) -> List[Dict[str, float]]:
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in catalog_sizes:
+        scores = rng.random(n)
+        exclude = int(rng.integers(n))
+        for k in k_values:
+            argsort_ms = time_call(lambda: argsort_top_k(scores, k, exclude), repeats)
+            partition_ms = time_call(lambda: select_top_k(scores, k, exclude), repeats)
+            results.append(
+                {
+                    "n_tracks": n,
+                    "k": k,
+                    "argsort_ms": argsort_ms,
+                    "argpartition_ms": partition_ms,
+                    "speedup": argsort_ms / partition_ms,
+                }
+            )
+            logging.info(
+                f"top-k n={n:>9,} k={k:>3} | argsort {argsort_ms:8.3f} ms | "
+                f"argpartition {partition_ms:8.3f} ms | x{argsort_ms / partition_ms:.1f}"
+            )
+    return results
+
+
+def _process_memory_kb() -> Dict[str, int]:
+    # RssAnon is private to the process; RssFile is shared page cache
+    memory = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                memory[key] = int(value.split()[0])
+    return memory
+
+
+def _measure_matrix_load(mode: str, path: str) -> Dict[str, float]:
+    # Runs in a fresh worker process so RSS reflects only this load
+    baseline = _process_memory_kb()
+    start = time.perf_counter()
+    matrix = load_npz(path) if mode == "npz" else load_csr_arrays(path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    # One full mat-vec touches every page, as a real query would
+    matrix @ np.ones(matrix.shape[1])
+    memory = _process_memory_kb()
+    return {
+        "mode": mode,
+        "load_ms": load_ms,
+        "rss_mb": (memory["VmRSS"] - baseline["VmRSS"]) / 1024,
+        "private_mb": (memory["RssAnon"] - baseline["RssAnon"]) / 1024,
+        "shared_mb": (memory["RssFile"] - baseline["RssFile"]) / 1024,
+    }
+
+
+def bench_matrix_loading(
+    npz_path: Path = MODELS_DIR / "normalized_data.npz",
+    mmap_dir: Path = MODELS_DIR / "normalized_data",
+    n_workers: int = 4,
+) -> List[Dict[str, float]]:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for mode, path in (("npz", npz_path), ("mmap", mmap_dir)):
+        with context.Pool(n_workers) as pool:
+            workers = pool.starmap(_measure_matrix_load, [(mode, str(path))] * n_workers)
+        summary = {
+            "mode": mode,
+            "n_workers": n_workers,
+            "load_ms": float(np.median([w["load_ms"] for w in workers])),
+            "rss_mb_per_worker": float(np.median([w["rss_mb"] for w in workers])),
+            "private_mb_per_worker": float(np.median([w["private_mb"] for w in workers])),
+            "private_mb_total": float(sum(w["private_mb"] for w in workers)),
+        }
+        results.append(summary)
+        logging.info(
+            f"load {mode:>4} x{n_workers} | {summary['load_ms']:8.2f} ms | "
+            f"RSS {summary['rss_mb_per_worker']:8.1f} MB/worker | "
+            f"private {summary['private_mb_per_worker']:8.1f} MB/worker "
+            f"({summary['private_mb_total']:.1f} MB total)"
+        )
+    return results
+
+
+def _query_latencies(fn: Callable[[int], object], queries: Sequence[int]) -> Dict[str, float]:
+    fn(queries[0])
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return latency_stats(timings)
+
+
+def bench_pipeline(
+    catalog_sizes: Sequence[int] = PIPELINE_SIZES,
+    n_queries: int = N_QUERIES,
+    k: int = 10,
+    seed: int = 42,
+) -> List[Dict]:
+    results = []
+    rng = np.random.default_rng(seed)
+    for n in catalog_sizes:
+        raw_df = synthetic_catalog(n, seed)
+        result = {"n_tracks": n}
+
+        cleaned, result["preprocess_tracks"] = measure(lambda: preprocess_tracks(raw_df))
+        features = prune_for_content_filtering(cleaned)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            transformer_path = Path(tmp) / "transformer.joblib"
+            preprocessor, result["train_feature_transformer"] = measure(
+                lambda: train_feature_transformer(features, transformer_path)
+            )
+            _, result["transform_dataset"] = measure(
+                lambda: transform_dataset(features, transformer_path)
+            )
+        transformed, result["transform_in_chunks"] = measure(
+            lambda: transform_in_chunks(preprocessor, features)
+        )
+        normalized, _ = normalize_rows(transformed)
+
+        song_index = build_song_index(cleaned)
+        queries = rng.choice(len(cleaned), min(n_queries, len(cleaned)), replace=False)
+        names, artists = cleaned["name"].to_numpy(), cleaned["artist"].to_numpy()
+        result["get_top_k_recommendations"] = _query_latencies(
+            lambda i: get_top_k_recommendations(
+                names[i],
+                artists[i],
+                cleaned,
+                normalized,
+                k,
+                normalized=True,
+                song_index=song_index,
+            ),
+            queries,
+        )
+
+        (artist_index, song_suggestion_index), result["build_suggestions"] = measure(
+            lambda: (build_artist_suggestions(cleaned), build_song_suggestions(cleaned))
+        )
+        # Partial inputs as typed in the app: short prefixes and mid-word fragments
+        prefix_lengths = rng.integers(2, 6, len(queries))
+        result["artist_suggestions"] = _query_latencies(
+            lambda i: artist_index.suggest(artists[i][: prefix_lengths[i % len(queries)]]),
+            queries,
+        )
+        result["song_suggestions"] = _query_latencies(
+            lambda i: song_suggestion_index.suggest(names[i][1:5], scope=artists[i]),
+            queries,
+        )
+        results.append(result)
+
+        logging.info(
+            f"n={n:>9,} | preprocess {result['preprocess_tracks']['seconds']:.2f}s | "
+            f"fit {result['train_feature_transformer']['seconds']:.2f}s | "
+            f"transform {result['transform_dataset']['seconds']:.2f}s "
+            f"(chunked {result['transform_in_chunks']['seconds']:.2f}s, "
+            f"peak {result['transform_in_chunks']['peak_mb']:.0f} MB)"
+        )
+        for stage in ("get_top_k_recommendations", "artist_suggestions", "song_suggestions"):
+            stats = result[stage]
+            logging.info(
+                f"n={n:>9,} | {stage:<26} p50 {stats['p50_ms']:8.3f} ms | "
+                f"p95 {stats['p95_ms']:8.3f} ms | p99 {stats['p99_ms']:8.3f} ms"
+            )
+    return results
+
+
+def bench_diversity(
+    paths: Optional[Paths] = None,
+    n_queries: int = N_QUERIES,
+    k: int = 10,
+    seed: int = 42,
+) -> List[Dict]:
+    # Plain top-k against the diversified modes on the trained catalog: the
+    # extra latency, and how many distinct artists and how much redundancy
+    # (mean pairwise cosine) each returned list has
+    paths = paths or Paths()
+    catalog = load_catalog(paths.cleaned_catalog, columns=DISPLAY_COLS)
+    normalized = load_csr_arrays(paths.normalized_arrays)
+    song_index = load_song_index(paths.song_index)
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(catalog), min(n_queries, len(catalog)), replace=False)
+    names, artists = catalog["name"].to_numpy(), catalog["artist"].to_numpy()
+
+    results = []
+    for mode in ("top_k", "artist", "mmr"):
+        diversity = None if mode == "top_k" else Diversity(mode)
+
+        def recommend(i, diversity=diversity):
+            return get_top_k_recommendations(
+                names[i],
+                artists[i],
+                catalog,
+                normalized,
+                k,
+                normalized=True,
+                song_index=song_index,
+                diversity=diversity,
+            )
+
+        result = {"mode": mode, "k": k, **_query_latencies(recommend, queries)}
+
+        distinct, redundancy = [], []
+        for i in queries:
+            recommendations = recommend(i)
+            rows = [
+                song_index.find(name, artist)
+                for name, artist in zip(recommendations["name"], recommendations["artist"])
+            ]
+            vectors = normalized[rows]
+            gram = (vectors @ vectors.T).toarray()
+            pairs = len(rows) * (len(rows) - 1)
+            redundancy.append((gram.sum() - np.trace(gram)) / pairs if pairs else 0.0)
+            distinct.append(recommendations["artist"].nunique())
+        result["distinct_artists"] = float(np.mean(distinct))
+        result["mean_pairwise_cosine"] = float(np.mean(redundancy))
+        results.append(result)
+        logging.info(
+            f"{mode:>6} k={k} | p50 {result['p50_ms']:7.3f} ms | p95 {result['p95_ms']:7.3f} ms | "
+            f"{result['distinct_artists']:.1f} artists | "
+            f"pairwise cosine {result['mean_pairwise_cosine']:.3f}"
+        )
+    return results
+
+
+def bench_filters(
+    paths: Optional[Paths] = None,
+    n_queries: int = N_QUERIES,
+    k: int = 10,
+    seed: int = 42,
+) -> List[Dict]:
+    # Filtered against unfiltered queries on the trained catalog, from filters
+    # that allow most rows (masked selection) to ones that allow a few percent
+    # (only the allowed rows are scored)
+    paths = paths or Paths()
+    catalog = load_catalog(
+        paths.cleaned_catalog, columns=list(dict.fromkeys(DISPLAY_COLS + ATTRIBUTE_COLS))
+    )
+    normalized = load_csr_arrays(paths.normalized_arrays)
+    song_index = load_song_index(paths.song_index)
+    attribute_index = load_attribute_index(paths.attribute_index)
+    if attribute_index is None:
+        attribute_index = build_attribute_index(catalog)
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(catalog), min(n_queries, len(catalog)), replace=False)
+    names, artists = catalog["name"].to_numpy(), catalog["artist"].to_numpy()
+    display = catalog[DISPLAY_COLS]
+
+    modes = {
+        "none": None,
+        "exclude_artist": lambda i: TrackFilter(exclude_artists=(artists[i],)),
+        "recent": lambda i: TrackFilter(year_min=int(np.median(catalog["year"]))),
+        "key_tempo": lambda i: TrackFilter(keys=(0, 7), tempo_window=10.0),
+    }
+    results = []
+    for mode, make_filter in modes.items():
+
+        def recommend(i, make_filter=make_filter):
+            return get_top_k_recommendations(
+                names[i],
+                artists[i],
+                display,
+                normalized,
+                k,
+                normalized=True,
+                song_index=song_index,
+                filters=make_filter(i) if make_filter else None,
+                attribute_index=attribute_index,
+            )
+
+        allowed = [
+            attribute_index.mask(make_filter(i), i).mean() if make_filter else 1.0 for i in queries
+        ]
+        result = {"mode": mode, "k": k, "allowed_fraction": float(np.mean(allowed))}
+        result.update(_query_latencies(recommend, queries))
+        results.append(result)
+        logging.info(
+            f"{mode:>14} k={k} | {result['allowed_fraction']:6.1%} allowed | "
+            f"p50 {result['p50_ms']:7.3f} ms | p95 {result['p95_ms']:7.3f} ms"
+        )
+    return results
+
+
+def _latency_metrics(results: List[Dict], prefix: str = "") -> Dict[str, float]:
+    # Flattens results into {"<row key>/<stage>/<metric>": value} for the
+    # latency, duration and memory metrics only
+    metrics = {}
+    for row in results:
+        row_key = prefix + "/".join(
+            f"{key}={value}" for key, value in row.items() if key in ("n_tracks", "k", "mode")
+        )
+        for stage, value in row.items():
+            if isinstance(value, dict):
+                for metric, number in value.items():
+                    if metric.endswith("_ms") or metric in ("seconds", "peak_mb"):
+                        metrics[f"{row_key}/{stage}/{metric}"] = number
+            elif stage.endswith("_ms"):
+                metrics[f"{row_key}/{stage}"] = value
+    return metrics
+
+
+def compare_results(
+    baseline_path: Path,
+    current_path: Path,
+    tolerance: float = REGRESSION_TOLERANCE,
+) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = _latency_metrics(json.load(f)["results"])
+    with open(current_path) as f:
+        current = _latency_metrics(json.load(f)["results"])
+
+    regressions = []
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name], current[name]
+        if before > 0 and after > before * (1 + tolerance):
+            regressions.append(name)
+            logging.warning(
+                f"REGRESSION {name}: {before:.3f} -> {after:.3f} (x{after / before:.2f})"
+            )
+    n_compared = len(baseline.keys() & current.keys())
+    logging.info(f"{len(regressions)} regressions in {n_compared} metrics")
+    return regressions
+
+
+def write_results(suite: str, results: List[Dict], path: Path) -> None:
+    # Environment is recorded so diffs between runs on different hosts stand out
+    report = {
+        "suite": suite,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recommendation hot paths.")
+    parser.add_argument(
+        "suite",
+        choices=["top_k", "loading", "pipeline", "diversity", "filters", "generate", "compare"],
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sizes", type=int, nargs="+", default=None, help="catalog sizes")
+    parser.add_argument("--queries", type=int, default=N_QUERIES)
+    parser.add_argument("--output", type=Path, default=None, help="write results as JSON")
+    parser.add_argument("--out-dir", type=Path, default=Path("../data/synthetic"))
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare against")
+    parser.add_argument("--current", type=Path, help="JSON results of the new run")
+    args = parser.parse_args()
+
+    if args.suite == "top_k":
+        results = bench_top_k(args.sizes or CATALOG_SIZES)
+    elif args.suite == "loading":
+        results = bench_matrix_loading(n_workers=args.workers)
+    elif args.suite == "pipeline":
+        results = bench_pipeline(args.sizes or PIPELINE_SIZES, args.queries)
+    elif args.suite == "diversity":
+        results = bench_diversity(n_queries=args.queries)
+    elif args.suite == "filters":
+        results = bench_filters(n_queries=args.queries)
+    elif args.suite == "generate":
+        for n in args.sizes or [PIPELINE_SIZES[0]]:
+            write_synthetic_data(n, args.out_dir / str(n))
+        return
+    else:
+        regressions = compare_results(args.baseline, args.current)
+        raise SystemExit(1 if regressions else 0)
+
+    if args.output:
+        write_results(args.suite, results, args.output)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    main()
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from pathlib import Path
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+CACHE_MAX_ENTRIES: int = 10_000
+CACHE_TTL_SECONDS: float = 3600.0
+# Artifact mtimes are re-read at most this often
+VERSION_CHECK_SECONDS: float = 1.0
+
+
+def model_version(artifacts: Iterable[Path]) -> str:
+    # Fingerprint of the artifacts results are computed from; rebuilding any
+    # of them changes the version and so every cache key
+    digest = hashlib.sha1()
+    for path in artifacts:
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+        except FileNotFoundError:
+            digest.update(f"{path}:missing;".encode())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    def __init__(
+        self,
+        artifacts: Iterable[Path],
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL_SECONDS,
+        disk_dir: Optional[Path] = None,
+        watch: bool = True,
+    ):
+        # watch=False leaves version changes to the owner (see set_version), for
+        # owners that must reload their own state before serving the new version
+        self.artifacts = list(artifacts)
+        self.watch = watch
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = model_version(self.artifacts)
+        self._version_checked = time.monotonic()
+        self._stats = dict.fromkeys(
+            ("hits", "disk_hits", "misses", "evictions", "expirations", "invalidations"), 0
+        )
+
+    def _refresh_version(self) -> None:
+        now = time.monotonic()
+        if not self.watch or now - self._version_checked < VERSION_CHECK_SECONDS:
+            return
+        self._version_checked = now
+        self._set_version(model_version(self.artifacts))
+
+    def _set_version(self, version: str) -> None:
+        if version != self._version:
+            logging.info(f"Model artifacts changed; dropping results cached for {self._version}")
+            self._version = version
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+            self._prune_disk()
+
+    def set_version(self, version: str) -> None:
+        with self._lock:
+            self._set_version(version)
+
+    def _disk_path(self, key: Hashable) -> Path:
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.disk_dir / self._version / f"{name}.pkl"
+
+    def _prune_disk(self) -> None:
+        # Results of older model versions can never be read again
+        if self.disk_dir is None or not self.disk_dir.exists():
+            return
+        for child in self.disk_dir.iterdir():
+            if child.is_dir() and child.name != self._version:
+                shutil.rmtree(child, ignore_errors=True)
+
+    def _read_disk(self, key: Hashable):
+        path = self._disk_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                return None
+            with open(path, "rb") as f:
+                stored_key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # A digest collision must not return another key's result
+        return (value,) if stored_key == key else None
+
+    def _write_disk(self, key: Hashable, value: Any) -> None:
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic rename, so concurrent workers never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._refresh_version()
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expirations"] += 1
+
+            stored = self._read_disk(key) if self.disk_dir is not None else None
+            if stored is not None:
+                self._stats["disk_hits"] += 1
+                self._insert(key, stored[0])
+                return stored[0]
+
+            self._stats["misses"] += 1
+            return default
+
+    def _insert(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._refresh_version()
+            self._insert(key, value)
+            if self.disk_dir is not None:
+                self._write_disk(key, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "version": self._version,
+            }
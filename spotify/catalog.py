@@ -0,0 +1,90 @@
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Imported both as a top-level script module and as spotify.catalog by the
+# modeling package, so the sibling import must work in either layout
+try:
+    from matrix_store import replace_atomically
+except ModuleNotFoundError:
+    from spotify.matrix_store import replace_atomically
+
+# Repeated strings are dictionary-encoded instead of stored once per row
+CATEGORICAL_COLS: List[str] = ["artist", "tags"]
+
+# Fixed narrow integer types, so every chunk of a streamed catalog agrees.
+# Nullable, so a track missing a value keeps it as <NA> instead of failing the
+# cast
+INTEGER_DTYPES: Dict[str, str] = {
+    "year": "Int16",
+    "duration_ms": "Int32",
+    "key": "Int8",
+    "mode": "Int8",
+    "time_signature": "Int8",
+}
+
+# Columns the serving app needs to display recommendations
+DISPLAY_COLS: List[str] = ["name", "artist", "spotify_preview_url"]
+
+
+def to_catalog_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in CATEGORICAL_COLS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    for col, dtype in INTEGER_DTYPES.items():
+        if col in df:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def save_catalog(df: pd.DataFrame, path: Path) -> None:
+    with replace_atomically(path) as scratch:
+        to_catalog_dtypes(df).to_parquet(scratch, index=False)
+    logging.info(f"Catalog saved to {path}")
+
+
+def _chunk_schema(table: pa.Table) -> pa.Schema:
+    # Pin dictionary index widths and untyped (all-null) columns so that later
+    # chunks can be cast to the schema of the first one
+    fields = []
+    for field in table.schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def save_catalog_chunks(chunks: Iterable[pd.DataFrame], path: Path) -> int:
+    # Appends each chunk as a Parquet row group, so only one chunk is in memory
+    writer = None
+    n_rows = 0
+    with replace_atomically(path) as scratch:
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(to_catalog_dtypes(chunk), preserve_index=False)
+                if writer is None:
+                    schema = _chunk_schema(table)
+                    writer = pq.ParquetWriter(scratch, schema)
+                writer.write_table(table.cast(schema))
+                n_rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    logging.info(f"Catalog saved to {path} ({n_rows} rows)")
+    return n_rows
+
+
+def catalog_columns(path: Path) -> List[str]:
+    # Reads only the Parquet footer, not the data
+    return pq.read_schema(path).names
+
+
+def load_catalog(path: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    return pd.read_parquet(path, columns=columns)
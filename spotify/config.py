@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+
+# Paths
+PROJ_ROOT = Path(__file__).resolve().parents[1]
+logger.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
+
+DATA_DIR = PROJ_ROOT / "data"
+RAW_DATA_DIR = DATA_DIR / "raw"
+INTERIM_DATA_DIR = DATA_DIR / "interim"
+PROCESSED_DATA_DIR = DATA_DIR / "processed"
+EXTERNAL_DATA_DIR = DATA_DIR / "external"
+
+MODELS_DIR = PROJ_ROOT / "models"
+
+CF_MODELS_DIR = MODELS_DIR / "collaborative"
+
+
+# Kept here rather than in spotify.modeling.collaborative so the flat scripts
+# (hybrid, pipeline) can locate the CF artifacts with a bare `from config`
+# import; config has no sibling imports and loads under either layout
+@dataclass(frozen=True, slots=True)
+class CFPaths:
+    model_dir: Path = CF_MODELS_DIR
+
+    @property
+    def interactions(self) -> Path:
+        # CSR arrays in matrix_store layout, so they can be memory-mapped
+        return self.model_dir / "interactions"
+
+    @property
+    def track_ids(self) -> Path:
+        return self.model_dir / "track_ids.parquet"
+
+    @property
+    def user_ids(self) -> Path:
+        return self.model_dir / "user_ids.parquet"
+
+    @property
+    def neighbours(self) -> Path:
+        return self.model_dir / "item_neighbours.npz"
+
+    @property
+    def build_stats(self) -> Path:
+        return self.model_dir / "build_stats.json"
+
+    @property
+    def als_factors(self) -> Path:
+        return self.model_dir / "als_factors.npz"
+
+    @property
+    def als_report(self) -> Path:
+        return self.model_dir / "als_report.json"
+
+
+REPORTS_DIR = PROJ_ROOT / "reports"
+FIGURES_DIR = REPORTS_DIR / "figures"
+
+# If tqdm is installed, configure loguru with tqdm.write
+# https://github.com/Delgan/loguru/issues/135
+try:
+    from tqdm import tqdm
+
+    logger.remove(0)
+    logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
+except ModuleNotFoundError:
+    pass
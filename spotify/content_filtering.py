@@ -1,25 +1,58 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import logging
 from pathlib import Path
 from dataclasses import dataclass
-from typing import List
+import time
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Tuple
 
-import joblib
 import numpy as np
 import pandas as pd
-from scipy.sparse import save_npz
-from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler, OneHotEncoder, StandardScaler
-from category_encoders.count import CountEncoder
-
-from data_cleaning import prune_for_content_filtering
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s"
+from scipy.sparse import csr_matrix, hstack, save_npz, vstack
+
+from ann import (
+    IVFIndex,
+    N_LISTS,
+    N_PROBE,
+    PROJECTION_DIM,
+    build_ivf_index,
+    recall_at_k,
+    save_ivf_index,
+    search_ivf_index,
+)
+from catalog import INTEGER_DTYPES, catalog_columns, load_catalog
+from data_cleaning import NON_FEATURE_COLS
+from diversity import Diversity, diversify
+from filters import SUBSET_SCORING_FRACTION, AttributeIndex, TrackFilter
+from instrumentation import (
+    configure_logging,
+    dump_metrics,
+    enable_metrics,
+    increment,
+    observe,
+    profile,
+    span,
 )
+from lookup import SongIndex
+from matrix_store import load_csr_arrays, replace_atomically, save_csr_arrays
+from ranking import select_top_k, top_k_rows
+from reduction import (
+    EMBEDDING_DTYPES,
+    REDUCED_DIM,
+    REDUCTION_METHODS,
+    embed_rows,
+    fit_reduction,
+    neighbour_overlap,
+    save_embeddings,
+    save_overlap_report,
+    score_dense,
+    score_dense_block,
+)
+
+# sklearn, category_encoders and joblib are only needed to fit or apply the
+# transformer, so serving processes never import them
+if TYPE_CHECKING:
+    from sklearn.compose import ColumnTransformer
 
 # Data & model paths
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -29,9 +62,29 @@ MODELS_DIR = BASE_DIR / "models"
 
 @dataclass(frozen=True, slots=True)
 class Paths:
-    cleaned_csv: Path = PROCESSED_DIR / "cleaned_data.csv"
+    cleaned_catalog: Path = PROCESSED_DIR / "cleaned_data.parquet"
+    song_index: Path = PROCESSED_DIR / "song_index.pkl"
     transformer_model: Path = MODELS_DIR / "transformer.joblib"
     transformed_output: Path = MODELS_DIR / "transformed_data.npz"
+    normalized_output: Path = MODELS_DIR / "normalized_data.npz"
+    row_norms_output: Path = MODELS_DIR / "row_norms.npy"
+    normalized_arrays: Path = MODELS_DIR / "normalized_data"
+    ann_index: Path = MODELS_DIR / "ann_index.npz"
+    drift_report: Path = MODELS_DIR / "drift_report.json"
+    neighbour_table: Path = MODELS_DIR / "content_neighbours"
+    embeddings: Path = MODELS_DIR / "embeddings"
+    serving_bundle: Path = MODELS_DIR / "serving"
+    attribute_index: Path = PROCESSED_DIR / "attribute_index"
+
+    @property
+    def model_artifacts(self) -> Tuple[Path, ...]:
+        # Files whose rebuild invalidates cached recommendations
+        return (
+            self.cleaned_catalog,
+            self.transformed_output,
+            self.normalized_arrays / "data.npy",
+            self.neighbour_table / "indices.npy",
+        )
 
 # Feature groups
 FREQ_ENCODE_COLS: List[str] = ["year"]
@@ -43,7 +96,61 @@ MINMAX_SCALE_COLS: List[str] = [
     "instrumentalness", "liveness", "valence"
 ]
 
-def train_feature_transformer(df: pd.DataFrame, save_path: Path) -> None:
+# Queries scored per block in batch mode; peak memory is roughly
+# BATCH_BLOCK_SIZE * (n_tracks + n_features) * 8 bytes
+BATCH_BLOCK_SIZE: int = 256
+
+# Rows per chunk in the parallel transform; bounds each worker's scratch memory
+TRANSFORM_CHUNK_SIZE: int = 50_000
+
+# Width of the precomputed neighbour table; covers every k the app offers
+N_NEIGHBOURS: int = 20
+
+class SongNotFoundError(ValueError):
+    # Raised for queried songs missing from the catalog, so callers can tell
+    # them apart from other invalid arguments
+    pass
+
+@dataclass(frozen=True, slots=True)
+class NeighbourTable:
+    # Row i holds the top-K neighbour rows of track i, best first
+    indices: np.ndarray
+    scores: np.ndarray
+
+    @property
+    def width(self) -> int:
+        return self.indices.shape[1]
+
+    def lookup(self, query_idx: int, k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        # None when k is wider than the table and must be scored live
+        if k > self.width:
+            return None
+        return self.indices[query_idx, :k], self.scores[query_idx, :k]
+
+def _transformer_input(df: pd.DataFrame) -> pd.DataFrame:
+    # The transformer cannot take pandas.NA, so the nullable integer columns
+    # go in as float with NaN for a missing value
+    return df.astype({col: np.float64 for col in INTEGER_DTYPES if col in df})
+
+def _zero_missing(matrix) -> csr_matrix:
+    # Missing values come out as NaN features (scaled or passed through); they
+    # are zeroed so a missing attribute adds nothing to any similarity
+    matrix = csr_matrix(matrix)
+    if np.isnan(matrix.data).any():
+        matrix.data[np.isnan(matrix.data)] = 0
+        matrix.eliminate_zeros()
+    return matrix
+
+def transform_rows(preprocessor: "ColumnTransformer", df: pd.DataFrame) -> csr_matrix:
+    return _zero_missing(preprocessor.transform(_transformer_input(df)))
+
+def train_feature_transformer(df: pd.DataFrame, save_path: Path) -> "ColumnTransformer":
+    from category_encoders.count import CountEncoder
+    import joblib
+    from sklearn.compose import ColumnTransformer
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.preprocessing import MinMaxScaler, OneHotEncoder, StandardScaler
+
     preprocessor = ColumnTransformer(
         transformers=[
             ("freq", CountEncoder(normalize=True, return_df=True), FREQ_ENCODE_COLS),
@@ -57,19 +164,112 @@ def train_feature_transformer(df: pd.DataFrame, save_path: Path) -> None:
         verbose=False,
         force_int_remainder_cols=False,
     )
-    preprocessor.fit(df)
+    with span("transform.fit"):
+        preprocessor.fit(_transformer_input(df))
     joblib.dump(preprocessor, save_path)
     logging.info(f"Transformer saved to {save_path}")
+    return preprocessor
+
+def transform_dataset(df: pd.DataFrame, transformer_path: Path) -> csr_matrix:
+    import joblib
 
-def transform_dataset(df: pd.DataFrame, transformer_path: Path) -> np.ndarray:
     preprocessor = joblib.load(transformer_path)
-    return preprocessor.transform(df)
+    with span("transform.transform"):
+        return transform_rows(preprocessor, df)
+
+def _transform_timed(
+    preprocessor: "ColumnTransformer", chunk: pd.DataFrame
+) -> Tuple[csr_matrix, Dict[str, float]]:
+    # Same blocks, in the same order, as ColumnTransformer.transform, but each
+    # fitted transformer is timed and every block stays sparse. Entries may
+    # also be the strings "drop" and "passthrough" (older sklearn keeps them
+    # for the remainder), and column selections may be empty
+    chunk = _transformer_input(chunk)
+    blocks, timings = [], {}
+    for name, transformer, cols in preprocessor.transformers_:
+        if isinstance(transformer, str) and transformer == "drop":
+            continue
+        if not isinstance(cols, str) and len(cols) == 0:
+            continue
+        start = time.perf_counter()
+        if isinstance(transformer, str) and transformer == "passthrough":
+            block = chunk[cols].to_numpy(dtype=np.float64)
+        else:
+            block = transformer.transform(chunk[cols])
+        blocks.append(csr_matrix(np.asarray(block) if isinstance(block, pd.DataFrame) else block))
+        timings[name] = time.perf_counter() - start
+    return _zero_missing(hstack(blocks, format="csr")), timings
+
+# Set by the transform pool initializer, so the fitted transformer is
+# unpickled once per worker rather than once per chunk
+_transform_state = {}
+
+def _init_transform_worker(preprocessor: "ColumnTransformer") -> None:
+    _transform_state["preprocessor"] = preprocessor
+
+def _transform_chunk(chunk: pd.DataFrame) -> Tuple[csr_matrix, Dict[str, float]]:
+    return _transform_timed(_transform_state["preprocessor"], chunk)
+
+def transform_in_chunks(
+    preprocessor: "ColumnTransformer",
+    df: pd.DataFrame,
+    chunk_size: int = TRANSFORM_CHUNK_SIZE,
+    n_workers: Optional[int] = None
+) -> csr_matrix:
+    # Row chunks are transformed in a process pool into CSR shards that are
+    # stacked without ever densifying the wide one-hot artist block
+    chunks = [df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size)]
+    if len(chunks) <= 1 or n_workers == 1:
+        results = [_transform_timed(preprocessor, chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_transform_worker, initargs=(preprocessor,)
+        ) as pool:
+            results = list(pool.map(_transform_chunk, chunks))
+
+    totals = {}
+    for _, timings in results:
+        for name, seconds in timings.items():
+            totals[name] = totals.get(name, 0.0) + seconds
+            # Workers time their own chunks; the parent records them
+            observe(f"transform.{name}", seconds * 1000)
+    logging.info(
+        f"Transformed {len(df)} rows in {len(chunks)} chunks; CPU seconds per transformer: "
+        + ", ".join(f"{name} {seconds:.2f}" for name, seconds in totals.items())
+    )
+    return vstack([shard for shard, _ in results], format="csr")
 
 def save_transformed_array(array, path: Path) -> None:
-    save_npz(path, array)
+    with replace_atomically(path) as scratch:
+        save_npz(scratch, array)
     logging.info(f"Transformed data saved to {path}")
 
-def compute_similarity_scores(query_vec, matrix) -> np.ndarray:
+def normalize_rows(matrix) -> Tuple[csr_matrix, np.ndarray]:
+    normalized = csr_matrix(matrix, dtype=np.float64, copy=True)
+    norms = np.sqrt(np.asarray(normalized.multiply(normalized).sum(axis=1)).ravel())
+
+    # Leave all-zero rows as zeros instead of dividing by zero
+    inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized.data *= np.repeat(inv_norms, np.diff(normalized.indptr))
+    return normalized, norms
+
+def save_normalized_array(matrix, norms: np.ndarray, matrix_path: Path, norms_path: Path) -> None:
+    with replace_atomically(matrix_path) as scratch:
+        save_npz(scratch, matrix)
+    with replace_atomically(norms_path) as scratch:
+        np.save(scratch, norms)
+    logging.info(f"Normalized data saved to {matrix_path} (row norms in {norms_path})")
+
+def compute_similarity_scores(query_vec, matrix, normalized: bool = False) -> np.ndarray:
+    if isinstance(matrix, np.ndarray):
+        # Dense unit-length embeddings from the reduction stage: one GEMV
+        return score_dense(matrix, query_vec).reshape(1, -1)
+    if normalized:
+        # Rows are already unit length, so cosine reduces to a sparse mat-vec
+        query = query_vec.toarray().ravel() if hasattr(query_vec, "toarray") else query_vec
+        return (matrix @ np.ravel(query)).reshape(1, -1)
+    from sklearn.metrics.pairwise import cosine_similarity
+
     return cosine_similarity(query_vec, matrix)
 
 def get_top_k_recommendations(
@@ -77,43 +277,382 @@ def get_top_k_recommendations(
     query_artist: str,
     raw_df: pd.DataFrame,
     features_matrix,
-    top_k: int = 10
+    top_k: int = 10,
+    normalized: bool = False,
+    ann_index: Optional[IVFIndex] = None,
+    n_probe: int = N_PROBE,
+    song_index: Optional[SongIndex] = None,
+    neighbour_table: Optional[NeighbourTable] = None,
+    diversity: Optional[Diversity] = None,
+    filters: Optional[TrackFilter] = None,
+    attribute_index: Optional[AttributeIndex] = None
 ) -> pd.DataFrame:
     query_name, query_artist = query_name.lower(), query_artist.lower()
-    query_match = raw_df[
-        (raw_df["name"] == query_name) & (raw_df["artist"] == query_artist)
-    ]
+    with span("recommend.lookup"):
+        if song_index is not None:
+            query_idx = song_index.find(query_name, query_artist)
+        else:
+            query_match = raw_df[
+                (raw_df["name"] == query_name) & (raw_df["artist"] == query_artist)
+            ]
+            query_idx = query_match.index[0] if not query_match.empty else None
 
-    if query_match.empty:
-        raise ValueError(f"Song '{query_name}' by '{query_artist}' not found.")
+    if query_idx is None:
+        increment("recommend.not_found")
+        raise SongNotFoundError(f"Song '{query_name}' by '{query_artist}' not found.")
 
-    query_idx = query_match.index[0]
-    query_vec = features_matrix[query_idx].reshape(1, -1)
+    # Filters become a mask over the catalog, applied before top-k selection
+    allowed = None
+    if filters is not None:
+        if attribute_index is None:
+            raise ValueError("Filtered queries need the attribute index.")
+        increment("recommend.filtered")
+        with span("recommend.filter"):
+            allowed = attribute_index.mask(filters, query_idx)
 
-    sim_scores = compute_similarity_scores(query_vec, features_matrix)
-    ranked_indices = np.argsort(sim_scores.ravel())[::-1]
-    ranked_indices = [i for i in ranked_indices if i != query_idx][:top_k]
+    # Diversified ranking re-ranks a wider pool of the best-scoring rows
+    n_ranked = max(top_k, diversity.pool_size) if diversity else top_k
+    precomputed = None
+    if neighbour_table and allowed is None:
+        precomputed = neighbour_table.lookup(query_idx, n_ranked)
+    elif neighbour_table and n_ranked <= neighbour_table.width:
+        # Usable only if enough of the stored neighbours pass the filters
+        indices, scores = neighbour_table.lookup(query_idx, neighbour_table.width)
+        keep = allowed[indices]
+        if keep.sum() >= n_ranked:
+            precomputed = indices[keep][:n_ranked], scores[keep][:n_ranked]
+    ranked_indices = ranked_scores = None
+    if precomputed is not None:
+        # Constant time: a slice of the offline neighbour table
+        increment("recommend.neighbour_table")
+        ranked_indices, ranked_scores = precomputed
+    elif ann_index is not None:
+        # The IVF index rescores its candidates against the normalized rows
+        if not normalized:
+            raise ValueError("ANN search requires the normalized feature matrix.")
+        increment("recommend.ann")
+        with span("recommend.ann"):
+            ranked_indices, ranked_scores = search_ivf_index(
+                ann_index, features_matrix, query_idx, n_ranked, n_probe,
+                exclude=query_idx, mask=allowed,
+            )
+        if allowed is not None:
+            # Selective filters can leave too few allowed rows in the probed
+            # lists; exact scoring of the allowed rows is cheap in that case
+            n_allowed = int(allowed.sum()) - bool(allowed[query_idx])
+            if len(ranked_indices) < min(n_ranked, n_allowed):
+                increment("recommend.ann_fallback")
+                ranked_indices = None
+    if ranked_indices is None:
+        increment("recommend.exhaustive")
+        subset = None
+        if allowed is not None and allowed.mean() < SUBSET_SCORING_FRACTION:
+            # Selective filters: only the allowed rows are scored
+            subset = np.flatnonzero(allowed)
+        with span("recommend.score"):
+            query_vec = features_matrix[query_idx].reshape(1, -1)
+            sim_scores = compute_similarity_scores(
+                query_vec,
+                features_matrix if subset is None else features_matrix[subset],
+                normalized=normalized,
+            )
+        with span("recommend.select"):
+            if subset is None:
+                ranked_indices, ranked_scores = select_top_k(
+                    sim_scores, n_ranked, exclude=query_idx, mask=allowed
+                )
+            else:
+                positions, ranked_scores = select_top_k(
+                    sim_scores, n_ranked, mask=subset != query_idx
+                )
+                ranked_indices = subset[positions]
 
-    recommendations = raw_df.iloc[ranked_indices][
-        ["name", "artist", "spotify_preview_url"]
-    ].reset_index(drop=True)
+    if diversity is not None:
+        increment(f"recommend.diversity.{diversity.method}")
+        with span("recommend.diversify"):
+            artists = raw_df["artist"].iloc[ranked_indices].to_numpy()
+            ranked_indices = ranked_indices[diversify(
+                ranked_indices, ranked_scores, features_matrix, artists, top_k, diversity
+            )]
+
+    with span("recommend.assemble"):
+        recommendations = raw_df.iloc[ranked_indices][
+            ["name", "artist", "spotify_preview_url"]
+        ].reset_index(drop=True)
 
     return recommendations
 
-def main():
+def resolve_query_indices(
+    queries: Sequence[Tuple[str, str]],
+    raw_df: pd.DataFrame,
+    song_index: Optional[SongIndex] = None
+) -> np.ndarray:
+    query_df = pd.DataFrame(queries, columns=["name", "artist"])
+    if song_index is not None:
+        rows = [song_index.find(name, artist) for name, artist in queries]
+        indices = np.array([-1 if row is None else row for row in rows], dtype=np.intp)
+    else:
+        # One hash join for all (name, artist) pairs instead of a mask per query
+        query_keys = pd.MultiIndex.from_arrays(
+            [query_df["name"].str.lower(), query_df["artist"].str.lower()]
+        )
+        catalog_keys = raw_df[["name", "artist"]].drop_duplicates()
+        positions = pd.MultiIndex.from_frame(catalog_keys).get_indexer(query_keys)
+        indices = np.where(positions >= 0, catalog_keys.index.to_numpy()[positions], -1)
+
+    missing = query_df[indices < 0]
+    if not missing.empty:
+        raise SongNotFoundError(
+            f"{len(missing)} queried songs not found, e.g. "
+            f"'{missing['name'].iloc[0]}' by '{missing['artist'].iloc[0]}'."
+        )
+    return indices
+
+def iter_batch_recommendations(
+    query_indices: Sequence[int],
+    normalized_matrix,
+    top_k: int = 10,
+    block_size: int = BATCH_BLOCK_SIZE
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    query_indices = np.asarray(query_indices, dtype=np.intp)
+    for start in range(0, len(query_indices), block_size):
+        block = query_indices[start:start + block_size]
+
+        # A single sparse x dense product scores the whole block of queries;
+        # dense embeddings go through score_dense_block, which never upcasts
+        # the whole float16 matrix at once
+        if isinstance(normalized_matrix, np.ndarray):
+            block_scores = score_dense_block(normalized_matrix, normalized_matrix[block])
+        else:
+            block_scores = (normalized_matrix @ normalized_matrix[block].toarray().T).T
+        indices, scores = top_k_rows(block_scores, top_k, exclude=block)
+        yield block, indices, scores
+
+def get_batch_recommendations(
+    queries: Sequence[Tuple[str, str]],
+    raw_df: pd.DataFrame,
+    normalized_matrix,
+    top_k: int = 10,
+    block_size: int = BATCH_BLOCK_SIZE,
+    song_index: Optional[SongIndex] = None
+) -> Iterator[pd.DataFrame]:
+    query_indices = resolve_query_indices(queries, raw_df, song_index)
+    batches = iter_batch_recommendations(query_indices, normalized_matrix, top_k, block_size)
+    for block, indices, scores in batches:
+        recommendations = raw_df.iloc[indices.ravel()][
+            ["name", "artist", "spotify_preview_url"]
+        ].reset_index(drop=True)
+        recommendations.insert(0, "query_index", np.repeat(block, indices.shape[1]))
+        recommendations.insert(1, "rank", np.tile(np.arange(indices.shape[1]), len(block)))
+        recommendations["score"] = scores.ravel()
+        yield recommendations
+
+# Set by the neighbour pool initializer; workers map the same matrix files
+_neighbour_matrix = {}
+
+def _init_neighbour_worker(arrays_dir: Path) -> None:
+    _neighbour_matrix["normalized"] = load_csr_arrays(arrays_dir)
+
+def _neighbour_block(bounds: Tuple[int, int], k: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    start, stop = bounds
+    _, indices, scores = next(iter_batch_recommendations(
+        np.arange(start, stop), _neighbour_matrix["normalized"], k, block_size=stop - start
+    ))
+    return start, indices.astype(np.int32), scores.astype(np.float16)
+
+def compute_neighbour_table(
+    arrays_dir: Path,
+    k: int = N_NEIGHBOURS,
+    block_size: int = BATCH_BLOCK_SIZE,
+    n_workers: Optional[int] = None
+) -> NeighbourTable:
+    # Blocks of rows are scored in worker processes against the memory-mapped
+    # matrix saved by save_csr_arrays, so the matrix is never pickled
+    n_tracks = load_csr_arrays(arrays_dir).shape[0]
+    width = min(k, max(n_tracks - 1, 0))
+    indices = np.zeros((n_tracks, width), dtype=np.int32)
+    scores = np.zeros((n_tracks, width), dtype=np.float16)
+
+    blocks = [
+        (start, min(start + block_size, n_tracks)) for start in range(0, n_tracks, block_size)
+    ]
+    with ProcessPoolExecutor(
+        max_workers=n_workers, initializer=_init_neighbour_worker, initargs=(arrays_dir,)
+    ) as pool:
+        for start, block_indices, block_scores in pool.map(
+            _neighbour_block, blocks, [width] * len(blocks)
+        ):
+            indices[start:start + len(block_indices)] = block_indices
+            scores[start:start + len(block_scores)] = block_scores
+    return NeighbourTable(indices, scores)
+
+def extend_neighbour_table(
+    table: NeighbourTable, normalized, block_size: int = BATCH_BLOCK_SIZE
+) -> NeighbourTable:
+    # Adds the rows appended to normalized since the table was built. New rows
+    # are scored against the whole catalog and existing rows only against the
+    # new ones, merged with their stored neighbours: O(catalog x new rows)
+    # instead of the O(catalog^2) of a rebuild
+    n_old, width = table.indices.shape[0], table.width
+    new_ids = np.arange(n_old, normalized.shape[0])
+    new_rows = normalized[new_ids].toarray().T
+    # Existing rows are merged in blocks of about 256K candidate scores; the
+    # matrix rows of every kept candidate are gathered to rescore it
+    merge_rows = max(block_size, (1 << 18) // max(width + len(new_ids), 1))
+
+    indices, scores = [], []
+    for start in range(0, n_old, merge_rows):
+        stop = min(start + merge_rows, n_old)
+        kept = table.indices[start:stop]
+        # The stored float16 scores round close neighbours together (up to
+        # 1.0), so they would outrank new rows that are in fact closer; the
+        # kept neighbours are rescored exactly against the matrix instead
+        queries = normalized[np.repeat(np.arange(start, stop), width)]
+        kept_scores = np.asarray(
+            queries.multiply(normalized[kept.ravel()]).sum(axis=1)
+        ).reshape(stop - start, width)
+        candidates = np.hstack([kept, np.broadcast_to(new_ids, (stop - start, len(new_ids)))])
+        candidate_scores = np.hstack([kept_scores, normalized[start:stop] @ new_rows])
+        positions, block_scores = top_k_rows(candidate_scores, width)
+        indices.append(np.take_along_axis(candidates, positions, axis=1))
+        scores.append(block_scores)
+    for _, block_indices, block_scores in iter_batch_recommendations(
+        new_ids, normalized, width, block_size
+    ):
+        indices.append(block_indices)
+        scores.append(block_scores)
+    return NeighbourTable(
+        np.vstack(indices).astype(np.int32), np.vstack(scores).astype(np.float16)
+    )
+
+def save_neighbour_table(table: NeighbourTable, directory: Path) -> None:
+    with replace_atomically(directory) as scratch:
+        scratch.mkdir(parents=True)
+        np.save(scratch / "indices.npy", table.indices)
+        np.save(scratch / "scores.npy", table.scores)
+    logging.info(f"Neighbour table ({table.width} per track) saved to {directory}")
+
+def load_neighbour_table(
+    directory: Path, n_rows: Optional[int] = None, mmap: bool = True
+) -> Optional[NeighbourTable]:
+    # None when no table was built, or when it was built for a catalog of
+    # another size than n_rows and its row ids would point at other tracks
+    if not (directory / "indices.npy").exists():
+        return None
+    mmap_mode = "r" if mmap else None
+    table = NeighbourTable(
+        np.load(directory / "indices.npy", mmap_mode=mmap_mode),
+        np.load(directory / "scores.npy", mmap_mode=mmap_mode),
+    )
+    if n_rows is not None and table.indices.shape[0] != n_rows:
+        logging.warning(
+            f"Ignoring the neighbour table in {directory}: it has {table.indices.shape[0]} "
+            f"rows but the feature matrix has {n_rows}; rebuild it with --neighbours"
+        )
+        return None
+    return table
+
+def main(
+    build_ann: bool = False,
+    ann_lists: int = N_LISTS,
+    ann_dim: int = PROJECTION_DIM,
+    ann_probes: Tuple[int, ...] = (1, 4, N_PROBE, 16),
+    n_neighbours: int = 0,
+    transform_chunk_size: int = TRANSFORM_CHUNK_SIZE,
+    transform_workers: Optional[int] = None,
+    reduce_dim: int = 0,
+    reduce_method: str = "svd",
+    embedding_dtype: str = "float32",
+    metrics_path: Optional[Path] = None,
+):
     paths = Paths()
+    if metrics_path is not None:
+        enable_metrics()
 
-    logging.info(f"Loading cleaned data from {paths.cleaned_csv} …")
-    df_raw = pd.read_csv(paths.cleaned_csv)
-    df_cleaned = prune_for_content_filtering(df_raw)
+    # Only the feature columns are read from the columnar catalog
+    logging.info(f"Loading cleaned data from {paths.cleaned_catalog} …")
+    feature_cols = [
+        col for col in catalog_columns(paths.cleaned_catalog) if col not in NON_FEATURE_COLS
+    ]
+    df_cleaned = load_catalog(paths.cleaned_catalog, columns=feature_cols)
 
     logging.info("Training feature transformer …")
-    train_feature_transformer(df_cleaned, paths.transformer_model)
+    preprocessor = train_feature_transformer(df_cleaned, paths.transformer_model)
 
     logging.info("Transforming dataset …")
-    transformed_matrix = transform_dataset(df_cleaned, paths.transformer_model)
+    transformed_matrix = transform_in_chunks(
+        preprocessor, df_cleaned, transform_chunk_size, transform_workers
+    )
 
     save_transformed_array(transformed_matrix, paths.transformed_output)
 
+    logging.info("Normalizing rows for serving …")
+    normalized_matrix, row_norms = normalize_rows(transformed_matrix)
+    save_normalized_array(
+        normalized_matrix, row_norms, paths.normalized_output, paths.row_norms_output
+    )
+    save_csr_arrays(normalized_matrix, paths.normalized_arrays)
+
+    if build_ann:
+        logging.info("Building ANN index …")
+        ann_index = build_ivf_index(normalized_matrix, n_lists=ann_lists, dim=ann_dim)
+        save_ivf_index(ann_index, paths.ann_index)
+        for n_probe in ann_probes:
+            recall_at_k(ann_index, normalized_matrix, k=10, n_probe=n_probe)
+
+    if reduce_dim:
+        logging.info(f"Reducing features to {reduce_dim} dimensions ({reduce_method}) …")
+        components = fit_reduction(normalized_matrix, reduce_dim, reduce_method)
+        embeddings = embed_rows(normalized_matrix, components, embedding_dtype)
+        save_embeddings(embeddings, components, paths.embeddings)
+        report = neighbour_overlap(normalized_matrix, embeddings)
+        save_overlap_report(report, paths.embeddings / "evaluation.json")
+
+    if n_neighbours:
+        logging.info(f"Precomputing the top-{n_neighbours} neighbour table …")
+        table = compute_neighbour_table(paths.normalized_arrays, n_neighbours)
+        save_neighbour_table(table, paths.neighbour_table)
+
+    if metrics_path is not None:
+        dump_metrics(metrics_path)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Train the content-based recommender.")
+    parser.add_argument("--ann", action="store_true", help="also build the IVF ANN index")
+    parser.add_argument("--ann-lists", type=int, default=N_LISTS)
+    parser.add_argument("--ann-dim", type=int, default=PROJECTION_DIM)
+    parser.add_argument(
+        "--neighbours", type=int, nargs="?", const=N_NEIGHBOURS, default=0,
+        help="also precompute the top-K neighbour table (default K: %(const)s)"
+    )
+    parser.add_argument("--transform-chunk-size", type=int, default=TRANSFORM_CHUNK_SIZE)
+    parser.add_argument(
+        "--transform-workers", type=int, default=None,
+        help="processes for the chunked transform (default: one per CPU)"
+    )
+    parser.add_argument(
+        "--reduce-dim", type=int, nargs="?", const=REDUCED_DIM, default=0,
+        help="also build dense embeddings of this size (default: %(const)s)"
+    )
+    parser.add_argument("--reduce-method", choices=REDUCTION_METHODS, default="svd")
+    parser.add_argument("--embedding-dtype", choices=EMBEDDING_DTYPES, default="float32")
+    parser.add_argument("--metrics", type=Path, default=None, help="write stage timings as JSON")
+    parser.add_argument(
+        "--profile", type=Path, default=None, help="write sampled stacks (collapsed format)"
+    )
+    args = parser.parse_args()
+
+    with profile(args.profile):
+        main(
+            build_ann=args.ann,
+            ann_lists=args.ann_lists,
+            ann_dim=args.ann_dim,
+            n_neighbours=args.neighbours,
+            transform_chunk_size=args.transform_chunk_size,
+            transform_workers=args.transform_workers,
+            reduce_dim=args.reduce_dim,
+            reduce_method=args.reduce_method,
+            embedding_dtype=args.embedding_dtype,
+            metrics_path=args.metrics,
+        )
\ No newline at end of file
@@ -1,35 +1,115 @@
+import argparse
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
 import pandas as pd
 
+from catalog import DISPLAY_COLS, load_catalog, save_catalog, save_catalog_chunks
+from filters import ATTRIBUTE_COLS, build_attribute_index, save_attribute_index
+from instrumentation import configure_logging, dump_metrics, enable_metrics, increment, span
+from lookup import build_song_index, save_song_index
+
+# Identifier/display columns that carry no content features
+NON_FEATURE_COLS: List[str] = ["track_id", "name", "spotify_preview_url"]
+
+# Rows read per chunk in streaming mode
+CHUNK_SIZE: int = 100_000
+
+
+def _clean_columns(df: pd.DataFrame) -> pd.DataFrame:
+    with span("clean.columns"):
+        # Drop columns that are not required
+        df = df.drop(columns=["genre", "spotify_id"])
+
+        # Fill missing tag information with a descriptive placeholder
+        df["tags"] = df["tags"].fillna("no_tags")
+
+        # Enforce lowercase for selected text columns
+        for col in ("name", "artist", "tags"):
+            df[col] = df[col].str.lower()
+
+    increment("clean.rows", len(df))
+    return df
+
 
 def preprocess_tracks(df: pd.DataFrame) -> pd.DataFrame:
     # Remove duplicate tracks, keeping the first occurrence
-    df = df.loc[~df.duplicated("track_id")]
+    with span("clean.dedupe"):
+        df = df.loc[~df.duplicated("track_id")]
 
-    # Drop columns that are not required
-    df = df.drop(columns=["genre", "spotify_id"])
+    return _clean_columns(df).reset_index(drop=True)
 
-    # Fill missing tag information with a descriptive placeholder
-    df["tags"] = df["tags"].fillna("no_tags")
 
-    # Enforce lowercase for selected text columns
-    for col in ("name", "artist", "tags"):
-        df[col] = df[col].str.lower()
+def preprocess_track_chunks(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    # Track ids seen so far are kept as a sorted array of 64-bit hashes
+    # (8 bytes per track) rather than a set of Python strings. Two distinct ids
+    # sharing a hash would drop the later track; for n tracks the chance is
+    # about n^2 / 2^65, under 1e-6 below 6M tracks, which is accepted here
+    seen = np.empty(0, dtype=np.uint64)
+    for chunk in chunks:
+        with span("clean.dedupe"):
+            hashes = pd.util.hash_pandas_object(chunk["track_id"], index=False).to_numpy()
 
-    return df.reset_index(drop=True)
+            positions = np.searchsorted(seen, hashes).clip(max=max(len(seen) - 1, 0))
+            seen_before = (seen[positions] == hashes) if len(seen) else np.zeros(len(hashes), bool)
+            keep = ~seen_before & ~pd.Series(hashes).duplicated().to_numpy()
+            # Merge the sorted new hashes in: one O(n) copy instead of a re-sort
+            new = np.sort(hashes[keep])
+            seen = np.insert(seen, np.searchsorted(seen, new), new)
+
+        if keep.any():
+            yield _clean_columns(chunk.loc[keep])
 
 
 def prune_for_content_filtering(df: pd.DataFrame) -> pd.DataFrame:
-    return df.drop(columns=["track_id", "name", "spotify_preview_url"])
+    return df.drop(columns=NON_FEATURE_COLS)
+
 
+def run_pipeline(path: str, chunksize: Optional[int] = None) -> None:
+    catalog_path = "../data/processed/cleaned_data.parquet"
+    if chunksize:
+        # Streaming mode: memory is bounded by one chunk plus the seen-set
+        chunks = pd.read_csv(path, chunksize=chunksize)
+        save_catalog_chunks(preprocess_track_chunks(chunks), catalog_path)
+        columns = list(dict.fromkeys(DISPLAY_COLS + ATTRIBUTE_COLS))
+        cleaned_df = load_catalog(catalog_path, columns=columns)
+    else:
+        with span("clean.read_csv"):
+            raw_df = pd.read_csv(path)
+        cleaned_df = preprocess_tracks(raw_df)
+        with span("clean.save"):
+            save_catalog(cleaned_df, catalog_path)
 
-def run_pipeline(path: str) -> None:
-    raw_df = pd.read_csv(path)
-    cleaned_df = preprocess_tracks(raw_df)
-    cleaned_df.to_csv("../data/processed/cleaned_data.csv", index=False)
+    # Persist the (name, artist) lookup next to the cleaned catalog
+    with span("clean.song_index"):
+        save_song_index(build_song_index(cleaned_df), "../data/processed/song_index.pkl")
+    # Sorted attribute columns for filtered recommendation queries
+    with span("clean.attribute_index"):
+        save_attribute_index(
+            build_attribute_index(cleaned_df), "../data/processed/attribute_index"
+        )
 
 
 if __name__ == "__main__":
+    configure_logging()
     # Path to the raw data file
     CSV_PATH = "../data/raw/Music Info.csv"
 
-    run_pipeline(CSV_PATH)
+    parser = argparse.ArgumentParser(description="Clean the raw track metadata.")
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        nargs="?",
+        const=CHUNK_SIZE,
+        default=None,
+        help=f"stream the raw CSV in chunks (default {CHUNK_SIZE} rows)",
+    )
+    parser.add_argument("--metrics", type=Path, default=None, help="write stage timings as JSON")
+    args = parser.parse_args()
+
+    if args.metrics is not None:
+        enable_metrics()
+    run_pipeline(CSV_PATH, chunksize=args.chunksize)
+    if args.metrics is not None:
+        dump_metrics(args.metrics)
@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DIVERSITY_METHODS: Tuple[str, ...] = ("mmr", "artist")
+# Best-scoring rows re-ranked for diversity; the catalog is scored only once
+POOL_SIZE: int = 200
+# Weight of relevance against similarity to the tracks already picked
+MMR_LAMBDA: float = 0.7
+MAX_PER_ARTIST: int = 2
+
+
+@dataclass(frozen=True, slots=True)
+class Diversity:
+    method: str = "mmr"
+    pool_size: int = POOL_SIZE
+    mmr_lambda: float = MMR_LAMBDA
+    # Applied by both methods; 0 disables the cap
+    max_per_artist: int = MAX_PER_ARTIST
+
+    def __post_init__(self):
+        if self.method not in DIVERSITY_METHODS:
+            raise ValueError(
+                f"Unknown diversity method '{self.method}'; expected one of {DIVERSITY_METHODS}."
+            )
+
+
+def artist_ranks(artists: np.ndarray) -> np.ndarray:
+    # Position of each entry among the earlier entries by the same artist
+    codes, _ = pd.factorize(artists)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(codes)])
+    ranks = np.empty(len(codes), dtype=np.intp)
+    ranks[order] = np.arange(len(codes)) - np.repeat(group_starts, group_sizes)
+    return ranks
+
+
+def cap_per_artist(artists: np.ndarray, k: int, max_per_artist: int) -> np.ndarray:
+    # Positions of the first k entries (in pool order) within each artist's quota
+    return np.flatnonzero(artist_ranks(artists) < max_per_artist)[:k]
+
+
+def _dense_row(vectors, row: int) -> np.ndarray:
+    if not hasattr(vectors, "indptr"):
+        return np.asarray(vectors[row], dtype=np.float64)
+    # Scattering one CSR row by hand avoids scipy's per-slice overhead
+    start, stop = vectors.indptr[row], vectors.indptr[row + 1]
+    dense = np.zeros(vectors.shape[1])
+    dense[vectors.indices[start:stop]] = vectors.data[start:stop]
+    return dense
+
+
+def mmr_select(
+    vectors,
+    relevance: np.ndarray,
+    k: int,
+    mmr_lambda: float = MMR_LAMBDA,
+    artists: Optional[np.ndarray] = None,
+    max_per_artist: int = 0,
+) -> np.ndarray:
+    # Greedy maximal marginal relevance over the pool's unit-length rows. Only
+    # the k picked rows' similarities are needed, so each pick costs one
+    # pool-sized mat-vec, a masked argmax and a running maximum
+    n_pool = len(relevance)
+    k = min(k, n_pool)
+    codes = pd.factorize(artists)[0] if artists is not None and max_per_artist else None
+    artist_counts = np.zeros(codes.max() + 1 if codes is not None and n_pool else 0, np.intp)
+
+    # Similarity to the closest pick so far, floored at 0 so that negative
+    # cosines (possible in dense embeddings) are not rewarded
+    redundancy = np.zeros(n_pool)
+    available = np.ones(n_pool, dtype=bool)
+    picked = []
+    for _ in range(k):
+        gain = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(gain))
+        if not np.isfinite(gain[best]):
+            break
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, vectors @ _dense_row(vectors, best), out=redundancy)
+        if codes is not None:
+            artist_counts[codes[best]] += 1
+            if artist_counts[codes[best]] >= max_per_artist:
+                available &= codes != codes[best]
+    return np.asarray(picked, dtype=np.intp)
+
+
+def diversify(
+    pool: np.ndarray,
+    pool_scores: np.ndarray,
+    features_matrix,
+    artists: np.ndarray,
+    k: int,
+    diversity: Diversity,
+) -> np.ndarray:
+    # Re-ranks a relevance-sorted candidate pool; returns the chosen pool positions
+    k = min(k, len(pool))
+    if diversity.method == "artist":
+        positions = cap_per_artist(artists, k, diversity.max_per_artist or len(pool))
+    else:
+        positions = mmr_select(
+            features_matrix[pool],
+            np.asarray(pool_scores, dtype=np.float64),
+            k,
+            diversity.mmr_lambda,
+            artists,
+            diversity.max_per_artist,
+        )
+
+    if len(positions) < k:
+        # Quotas exhausted the pool; fill up with the best remaining rows
+        rest = np.setdiff1d(np.arange(len(pool)), positions, assume_unique=True)
+        positions = np.concatenate([positions, rest[: k - len(positions)]])
+    return positions
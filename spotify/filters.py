@@ -0,0 +1,180 @@
+import argparse
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from catalog import load_catalog
+from instrumentation import configure_logging
+from lookup import key_hashes, normalize_key
+from matrix_store import replace_atomically
+
+# Attributes filtered by value or range, and the row value kept for filters
+# relative to the query track (e.g. tempo within +/-10 BPM of the seed)
+NUMERIC_ATTRIBUTES: Tuple[str, ...] = ("year", "key", "time_signature", "tempo")
+# Strings are indexed by 64-bit hash so every array can be memory-mapped
+HASHED_ATTRIBUTES: Tuple[str, ...] = ("artist", "track_id")
+ATTRIBUTE_COLS = list(NUMERIC_ATTRIBUTES + HASHED_ATTRIBUTES)
+
+# Below this fraction of allowed rows, only the allowed rows are scored
+SUBSET_SCORING_FRACTION: float = 0.2
+
+
+@dataclass(frozen=True, slots=True)
+class TrackFilter:
+    # Inclusive bounds; None leaves the side open
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    keys: Tuple[int, ...] = ()
+    time_signatures: Tuple[int, ...] = ()
+    tempo_min: Optional[float] = None
+    tempo_max: Optional[float] = None
+    # Half-width around the query track's tempo, combined with the bounds above
+    tempo_window: Optional[float] = None
+    artists: Tuple[str, ...] = ()
+    exclude_artists: Tuple[str, ...] = ()
+    exclude_track_ids: Tuple[str, ...] = ()
+
+
+def _hash_artists(artists: Iterable[str]) -> np.ndarray:
+    keys = [normalize_key(artist) for artist in artists]
+    return key_hashes(keys, len(keys))
+
+
+def _hash_track_ids(track_ids: Iterable[str]) -> np.ndarray:
+    keys = [str(track_id) for track_id in track_ids]
+    return key_hashes(keys, len(keys))
+
+
+@dataclass(frozen=True, slots=True)
+class AttributeIndex:
+    # attribute -> values sorted ascending and the catalog row of each value
+    sorted_values: Dict[str, np.ndarray]
+    sorted_rows: Dict[str, np.ndarray]
+    # attribute -> value of every catalog row, for the numeric attributes
+    row_values: Dict[str, np.ndarray]
+    n_rows: int
+
+    def range_rows(self, attribute: str, low=None, high=None) -> np.ndarray:
+        values = self.sorted_values[attribute]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        stop = len(values) if high is None else np.searchsorted(values, high, side="right")
+        return self.sorted_rows[attribute][start:stop]
+
+    def value_rows(self, attribute: str, targets) -> np.ndarray:
+        values = self.sorted_values[attribute]
+        targets = np.asarray(targets, dtype=values.dtype)
+        starts = np.searchsorted(values, targets, side="left")
+        stops = np.searchsorted(values, targets, side="right")
+        rows = self.sorted_rows[attribute]
+        slices = [rows[start:stop] for start, stop in zip(starts, stops)]
+        return np.concatenate(slices) if slices else rows[:0]
+
+    def mask(self, track_filter: TrackFilter, query_idx: Optional[int] = None) -> np.ndarray:
+        # Boolean mask of the catalog rows the filter allows
+        mask = np.ones(self.n_rows, dtype=bool)
+
+        def keep_only(rows: np.ndarray) -> None:
+            allowed = np.zeros(self.n_rows, dtype=bool)
+            allowed[rows] = True
+            mask[:] &= allowed
+
+        f = track_filter
+        if f.year_min is not None or f.year_max is not None:
+            keep_only(self.range_rows("year", f.year_min, f.year_max))
+        if f.keys:
+            keep_only(self.value_rows("key", f.keys))
+        if f.time_signatures:
+            keep_only(self.value_rows("time_signature", f.time_signatures))
+
+        tempo_min, tempo_max = f.tempo_min, f.tempo_max
+        if f.tempo_window is not None:
+            if query_idx is None:
+                raise ValueError("tempo_window needs the query track.")
+            tempo = float(self.row_values["tempo"][query_idx])
+            low, high = tempo - f.tempo_window, tempo + f.tempo_window
+            tempo_min = low if tempo_min is None else max(low, tempo_min)
+            tempo_max = high if tempo_max is None else min(high, tempo_max)
+        if tempo_min is not None or tempo_max is not None:
+            keep_only(self.range_rows("tempo", tempo_min, tempo_max))
+
+        if f.artists:
+            keep_only(self.value_rows("artist", _hash_artists(f.artists)))
+        if f.exclude_artists:
+            mask[self.value_rows("artist", _hash_artists(f.exclude_artists))] = False
+        if f.exclude_track_ids:
+            mask[self.value_rows("track_id", _hash_track_ids(f.exclude_track_ids))] = False
+        return mask
+
+
+def build_attribute_index(df: pd.DataFrame) -> AttributeIndex:
+    # Rows missing a value (<NA> in the nullable integer columns) are left out
+    # of that attribute's sorted arrays, so no filter on the attribute matches
+    # them; by row they read as NaN
+    columns = {}
+    for col in NUMERIC_ATTRIBUTES:
+        present = df[col].dropna()
+        dtype = getattr(present.dtype, "numpy_dtype", present.dtype)
+        columns[col] = (present.to_numpy(dtype=dtype), np.flatnonzero(df[col].notna()))
+    all_rows = np.arange(len(df))
+    columns["artist"] = (_hash_artists(df["artist"].astype(object).fillna("")), all_rows)
+    columns["track_id"] = (_hash_track_ids(df["track_id"]), all_rows)
+
+    sorted_values, sorted_rows = {}, {}
+    for name, (values, rows) in columns.items():
+        order = np.argsort(values, kind="stable")
+        sorted_values[name], sorted_rows[name] = values[order], rows[order].astype(np.int32)
+    row_values = {
+        col: df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in NUMERIC_ATTRIBUTES
+    }
+    return AttributeIndex(sorted_values, sorted_rows, row_values, len(df))
+
+
+def save_attribute_index(index: AttributeIndex, directory: Path) -> None:
+    directory = Path(directory)
+    with replace_atomically(directory) as scratch:
+        scratch.mkdir(parents=True)
+        for name in index.sorted_values:
+            np.save(scratch / f"{name}.values.npy", index.sorted_values[name])
+            np.save(scratch / f"{name}.rows.npy", index.sorted_rows[name])
+        for name, values in index.row_values.items():
+            np.save(scratch / f"{name}.by_row.npy", values)
+    logging.info(f"Attribute index saved to {directory}")
+
+
+def load_attribute_index(directory: Path, mmap: bool = True) -> Optional[AttributeIndex]:
+    # None when no index has been built
+    directory = Path(directory)
+    if not (directory / "track_id.rows.npy").exists():
+        return None
+    mmap_mode = "r" if mmap else None
+    names = NUMERIC_ATTRIBUTES + HASHED_ATTRIBUTES
+    sorted_values = {n: np.load(directory / f"{n}.values.npy", mmap_mode=mmap_mode) for n in names}
+    sorted_rows = {n: np.load(directory / f"{n}.rows.npy", mmap_mode=mmap_mode) for n in names}
+    row_values = {
+        n: np.load(directory / f"{n}.by_row.npy", mmap_mode=mmap_mode) for n in NUMERIC_ATTRIBUTES
+    }
+    return AttributeIndex(sorted_values, sorted_rows, row_values, len(sorted_rows["track_id"]))
+
+
+def main(catalog_path: Path, index_dir: Path):
+    start = time.perf_counter()
+    catalog = load_catalog(catalog_path, columns=ATTRIBUTE_COLS)
+    save_attribute_index(build_attribute_index(catalog), index_dir)
+    logging.info(f"Indexed {len(catalog)} tracks in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Build the index for filtered queries.")
+    parser.add_argument(
+        "--catalog", type=Path, default=Path("../data/processed/cleaned_data.parquet")
+    )
+    parser.add_argument("--out", type=Path, default=Path("../data/processed/attribute_index"))
+    args = parser.parse_args()
+
+    main(args.catalog, args.out)
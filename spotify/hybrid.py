@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, hstack
+
+from catalog import DISPLAY_COLS, load_catalog
+from config import CFPaths
+from content_filtering import MODELS_DIR, Paths
+from instrumentation import configure_logging
+from lookup import SongIndex
+from matrix_store import load_csr_arrays, save_csr_arrays
+from ranking import select_top_k
+
+HYBRID_DIR = MODELS_DIR / "hybrid_data"
+
+CONTENT_WEIGHT: float = 0.7
+CF_WEIGHT: float = 0.3
+
+
+@dataclass(frozen=True, slots=True)
+class HybridIndex:
+    # Catalog rows x [content features | unit ALS item factors]. Tracks without
+    # listens have an empty CF block and are scored on content alone
+    matrix: csr_matrix
+    n_content_cols: int
+    has_listens: np.ndarray
+
+    def scores(
+        self,
+        query_idx: int,
+        content_weight: float = CONTENT_WEIGHT,
+        cf_weight: float = CF_WEIGHT,
+        candidates: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        # Both similarities are dot products over disjoint column blocks, so
+        # w_c * content + w_cf * cf is one mat-vec with a weighted query
+        query = self.matrix[query_idx].toarray().ravel()
+        if not self.has_listens[query_idx]:
+            # Cold start: content only, at full weight
+            content_weight, cf_weight = 1.0, 0.0
+        query[: self.n_content_cols] *= content_weight
+        query[self.n_content_cols :] *= cf_weight
+
+        matrix = self.matrix if candidates is None else self.matrix[candidates]
+        scores = matrix @ query
+        if cf_weight and content_weight:
+            # A cold candidate's score is content_weight * content; undoing the
+            # weight scores it on content alone instead of as if CF were 0
+            has_listens = self.has_listens if candidates is None else self.has_listens[candidates]
+            scores[~has_listens] /= content_weight
+        return scores
+
+
+def align_cf_factors(
+    catalog_track_ids: pd.Series,
+    cf_track_ids: np.ndarray,
+    item_factors: np.ndarray,
+) -> np.ndarray:
+    # Reorder the CF factors into catalog row order; unseen tracks stay zero
+    norms = np.linalg.norm(item_factors, axis=1, keepdims=True)
+    unit_factors = np.divide(item_factors, norms, out=np.zeros_like(item_factors), where=norms > 0)
+    cf_rows = pd.Index(cf_track_ids).get_indexer(catalog_track_ids)
+    aligned = np.zeros((len(catalog_track_ids), item_factors.shape[1]), dtype=np.float32)
+    aligned[cf_rows >= 0] = unit_factors[cf_rows[cf_rows >= 0]]
+    return aligned
+
+
+def build_hybrid_index(normalized_content, aligned_factors: np.ndarray) -> HybridIndex:
+    matrix = hstack(
+        [csr_matrix(normalized_content, dtype=np.float32), csr_matrix(aligned_factors)],
+        format="csr",
+    )
+    has_listens = np.any(aligned_factors != 0, axis=1)
+    return HybridIndex(matrix, normalized_content.shape[1], has_listens)
+
+
+def save_hybrid_index(index: HybridIndex, directory: Path) -> None:
+    save_csr_arrays(index.matrix, directory)
+    np.save(Path(directory) / "has_listens.npy", index.has_listens)
+    with open(Path(directory) / "hybrid.json", "w") as f:
+        json.dump({"n_content_cols": index.n_content_cols}, f)
+
+
+def load_hybrid_index(directory: Path, mmap: bool = True) -> HybridIndex:
+    directory = Path(directory)
+    with open(directory / "hybrid.json") as f:
+        n_content_cols = json.load(f)["n_content_cols"]
+    return HybridIndex(
+        load_csr_arrays(directory, mmap=mmap),
+        n_content_cols,
+        np.load(directory / "has_listens.npy"),
+    )
+
+
+def get_hybrid_recommendations(
+    query_name: str,
+    query_artist: str,
+    raw_df: pd.DataFrame,
+    hybrid: HybridIndex,
+    song_index: SongIndex,
+    top_k: int = 10,
+    content_weight: float = CONTENT_WEIGHT,
+    cf_weight: float = CF_WEIGHT,
+    candidates: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    query_idx = song_index.find(query_name.lower(), query_artist.lower())
+    if query_idx is None:
+        raise ValueError(f"Song '{query_name}' by '{query_artist}' not found.")
+
+    scores = hybrid.scores(query_idx, content_weight, cf_weight, candidates)
+    if candidates is None:
+        ranked, ranked_scores = select_top_k(scores, top_k, exclude=query_idx)
+    else:
+        candidates = np.asarray(candidates)
+        is_query = np.flatnonzero(candidates == query_idx)
+        ranked, ranked_scores = select_top_k(
+            scores, top_k, exclude=int(is_query[0]) if len(is_query) else None
+        )
+        ranked = candidates[ranked]
+
+    recommendations = raw_df.iloc[ranked][DISPLAY_COLS].reset_index(drop=True)
+    recommendations["score"] = ranked_scores
+    return recommendations
+
+
+def main(paths: Optional[Paths] = None, cf_paths: Optional[CFPaths] = None):
+    # The CF artifacts are written by `python -m spotify.modeling.train --als`
+    # from the repository root. This module uses the flat layout like the
+    # other scripts here, so it runs from this directory: `python hybrid.py`
+    paths = paths or Paths()
+    cf_paths = cf_paths or CFPaths()
+    logging.info("Aligning ALS item factors with the catalog …")
+    catalog_track_ids = load_catalog(paths.cleaned_catalog, columns=["track_id"])["track_id"]
+    cf_track_ids = pd.read_parquet(cf_paths.track_ids, columns=["track_id"])["track_id"].to_numpy()
+    with np.load(cf_paths.als_factors) as arrays:
+        item_factors = arrays["item_factors"]
+    aligned = align_cf_factors(catalog_track_ids, cf_track_ids, item_factors)
+
+    content = load_csr_arrays(paths.normalized_arrays)
+    hybrid = build_hybrid_index(content, aligned)
+    save_hybrid_index(hybrid, HYBRID_DIR)
+    logging.info(
+        f"Hybrid index built: {hybrid.has_listens.sum():,} of {len(aligned):,} tracks "
+        "have listening history"
+    )
+
+
+if __name__ == "__main__":
+    configure_logging()
+    main()
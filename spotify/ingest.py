@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+from typing import Dict, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy.sparse import load_npz, vstack
+
+from ann import add_to_ivf_index, load_ivf_index, save_ivf_index
+from catalog import load_catalog, save_catalog
+from content_filtering import (
+    Paths,
+    extend_neighbour_table,
+    load_neighbour_table,
+    normalize_rows,
+    save_neighbour_table,
+    save_normalized_array,
+    save_transformed_array,
+    transform_rows,
+)
+from data_cleaning import preprocess_tracks, prune_for_content_filtering
+from filters import build_attribute_index, save_attribute_index
+from instrumentation import configure_logging
+from lookup import build_song_index, save_song_index
+from matrix_store import save_csr_arrays
+from reduction import embed_rows, load_embeddings, save_embeddings
+from serving import build_serving_bundle
+
+# Drift levels above which a full refit of the transformer is recommended
+UNSEEN_CATEGORY_THRESHOLD: float = 0.05
+UNTAGGED_ROWS_THRESHOLD: float = 0.2
+MEAN_SHIFT_THRESHOLD: float = 0.5
+OUT_OF_RANGE_THRESHOLD: float = 0.05
+
+
+def _unseen_fraction(values: pd.Series, known) -> float:
+    return float((~values.isin(known)).mean()) if len(values) else 0.0
+
+
+def detect_encoder_drift(preprocessor, df: pd.DataFrame) -> Dict[str, Dict]:
+    report = {}
+    for name, transformer, cols in preprocessor.transformers_:
+        if name == "freq":
+            # Values the count encoder never saw all collapse to one code
+            known = {m["col"]: m["mapping"].index for m in transformer.ordinal_encoder.mapping}
+            stats = {col: _unseen_fraction(df[col], known[col]) for col in cols if col in known}
+            worst = max(stats.values(), default=0.0)
+            report[name] = {"unseen_fraction": stats, "drifted": worst > UNSEEN_CATEGORY_THRESHOLD}
+        elif name == "ohe":
+            # handle_unknown="ignore" encodes unseen artists/keys as all zeros
+            stats = {
+                col: _unseen_fraction(df[col], categories)
+                for col, categories in zip(cols, transformer.categories_)
+            }
+            worst = max(stats.values(), default=0.0)
+            report[name] = {"unseen_fraction": stats, "drifted": worst > UNSEEN_CATEGORY_THRESHOLD}
+        elif name == "tfidf":
+            # Rows without any in-vocabulary tag get an empty TF-IDF block
+            analyzer = transformer.build_analyzer()
+            vocabulary = transformer.vocabulary_
+            untagged = (
+                float(
+                    np.mean(
+                        [
+                            not any(token in vocabulary for token in analyzer(doc))
+                            for doc in df[cols].astype(str)
+                        ]
+                    )
+                )
+                if len(df)
+                else 0.0
+            )
+            report[name] = {
+                "untagged_fraction": untagged,
+                "drifted": untagged > UNTAGGED_ROWS_THRESHOLD,
+            }
+        elif name == "standard":
+            # Shift of the new rows' mean, in units of the fitted std
+            shift = np.abs(df[cols].mean().to_numpy() - transformer.mean_) / transformer.scale_
+            stats = dict(zip(cols, shift.round(4).tolist()))
+            report[name] = {
+                "mean_shift": stats,
+                "drifted": bool(shift.max() > MEAN_SHIFT_THRESHOLD),
+            }
+        elif name == "minmax":
+            values = df[cols].to_numpy()
+            outside = (values < transformer.data_min_) | (values > transformer.data_max_)
+            stats = dict(zip(cols, outside.mean(axis=0).round(4).tolist()))
+            report[name] = {
+                "out_of_range_fraction": stats,
+                "drifted": bool(outside.mean(axis=0).max() > OUT_OF_RANGE_THRESHOLD),
+            }
+    return report
+
+
+def ingest_new_tracks(raw_df: pd.DataFrame, paths: Optional[Paths] = None) -> Dict:
+    # Compute grows with the new rows only: they alone are transformed, and
+    # the neighbour table and IVF lists are extended rather than rebuilt. The
+    # matrices, catalog and indexes are still rewritten whole, so I/O grows
+    # with the catalog. Every file is written aside and renamed into place,
+    # so serving processes that mapped the old files keep a consistent view
+    paths = paths or Paths()
+    catalog = load_catalog(paths.cleaned_catalog)
+    new_df = preprocess_tracks(raw_df)
+    new_df = new_df[~new_df["track_id"].isin(catalog["track_id"])].reset_index(drop=True)
+    if new_df.empty:
+        logging.info("No new tracks to ingest.")
+        return {"n_added": 0, "n_tracks": len(catalog), "refit_recommended": False}
+
+    transformed = load_npz(paths.transformed_output)
+    if transformed.shape[0] != len(catalog):
+        raise ValueError(
+            f"Feature matrix has {transformed.shape[0]} rows but the catalog has "
+            f"{len(catalog)}; run a full rebuild."
+        )
+
+    # Only the new rows go through the saved transformer
+    preprocessor = joblib.load(paths.transformer_model)
+    features = prune_for_content_filtering(new_df)[list(preprocessor.feature_names_in_)]
+    new_rows = transform_rows(preprocessor, features)
+    logging.info(f"Transformed {len(new_df)} new tracks")
+
+    save_transformed_array(vstack([transformed, new_rows], format="csr"), paths.transformed_output)
+
+    new_normalized, new_norms = normalize_rows(new_rows)
+    normalized = vstack([load_npz(paths.normalized_output), new_normalized], format="csr")
+    norms = np.concatenate([np.load(paths.row_norms_output), new_norms])
+    save_normalized_array(normalized, norms, paths.normalized_output, paths.row_norms_output)
+    save_csr_arrays(normalized, paths.normalized_arrays)
+
+    # New rows go through the saved reduction; existing embeddings are unchanged
+    if (paths.embeddings / "embeddings.npy").exists():
+        embeddings, components = load_embeddings(paths.embeddings, mmap=False)
+        new_embeddings = embed_rows(new_normalized, components, embeddings.dtype)
+        save_embeddings(np.vstack([embeddings, new_embeddings]), components, paths.embeddings)
+
+    # Existing rows can only gain new rows as neighbours
+    neighbour_table = load_neighbour_table(paths.neighbour_table, transformed.shape[0], mmap=False)
+    if neighbour_table is not None:
+        save_neighbour_table(
+            extend_neighbour_table(neighbour_table, normalized), paths.neighbour_table
+        )
+
+    first_id = len(catalog)
+    catalog = pd.concat([catalog, new_df], ignore_index=True)
+    save_catalog(catalog, paths.cleaned_catalog)
+    save_song_index(build_song_index(catalog), paths.song_index)
+    save_attribute_index(build_attribute_index(catalog), paths.attribute_index)
+
+    if paths.ann_index.exists():
+        ann_index = add_to_ivf_index(load_ivf_index(paths.ann_index), new_normalized, first_id)
+        save_ivf_index(ann_index, paths.ann_index)
+
+    # A bundle left alone would be stale and ignored by serving
+    if paths.serving_bundle.exists():
+        build_serving_bundle(paths)
+
+    encoders = detect_encoder_drift(preprocessor, features)
+    report = {
+        "n_added": len(new_df),
+        "n_tracks": len(catalog),
+        "refit_recommended": any(encoder["drifted"] for encoder in encoders.values()),
+        "encoders": encoders,
+    }
+    with open(paths.drift_report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    drifted = [name for name, encoder in encoders.items() if encoder["drifted"]]
+    logging.info(f"Ingested {len(new_df)} tracks; drifted encoders: {drifted or 'none'}")
+    return report
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Add new tracks without refitting.")
+    parser.add_argument("csv_path", help="raw CSV with the same columns as Music Info.csv")
+    args = parser.parse_args()
+
+    ingest_new_tracks(pd.read_csv(args.csv_path))
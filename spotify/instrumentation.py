@@ -0,0 +1,227 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+# Histogram bucket upper bounds in milliseconds, roughly 1.5x apart from
+# 10 microseconds to 60 seconds; anything slower lands in the last bucket
+BUCKET_BOUNDS_MS: List[float] = [0.01 * 1.5**i for i in range(39)]
+PROFILE_INTERVAL: float = 0.005
+LOG_FORMAT: str = "%(asctime)s | %(levelname)s | %(message)s"
+
+# Off unless SPOTIFY_METRICS is set or enable_metrics() is called; disabled spans
+# cost one function call and a shared no-op context manager
+_enabled: bool = os.environ.get("SPOTIFY_METRICS", "") not in ("", "0")
+_NULL_SPAN = nullcontext()
+
+
+def configure_logging() -> None:
+    # Called by each entry point rather than at import time, so importing a
+    # module never reconfigures the host application's logging
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+
+class Histogram:
+    __slots__ = ("counts", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, counts: List[int], total_ms: float, max_ms: float) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, max_ms)
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        target, seen = q * sum(self.counts), 0
+        for bound, count in zip(BUCKET_BOUNDS_MS + [self.max_ms], self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> Dict[str, float]:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "mean_ms": self.total_ms / count if count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": self.max_ms,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Counter = Counter()
+        self._started = time.time()
+
+    def observe(self, name: str, ms: float) -> None:
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            self._histograms[name].observe(ms)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def drain(self) -> Dict:
+        # Raw bucket counts, reset afterwards; worker processes ship these to
+        # the parent, which merges them into its own registry
+        with self._lock:
+            raw = {
+                "counters": dict(self._counters),
+                "histograms": {
+                    name: (h.counts, h.total_ms, h.max_ms) for name, h in self._histograms.items()
+                },
+            }
+            self._histograms.clear()
+            self._counters.clear()
+        return raw
+
+    def merge(self, raw: Dict) -> None:
+        with self._lock:
+            self._counters.update(raw["counters"])
+            for name, (counts, total_ms, max_ms) in raw["histograms"].items():
+                if name not in self._histograms:
+                    self._histograms[name] = Histogram()
+                self._histograms[name].merge(counts, total_ms, max_ms)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": _enabled,
+                "uptime_seconds": time.time() - self._started,
+                "counters": dict(sorted(self._counters.items())),
+                "histograms": {
+                    name: self._histograms[name].summary() for name in sorted(self._histograms)
+                },
+            }
+
+
+metrics = MetricsRegistry()
+
+
+def enable_metrics() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable_metrics() -> None:
+    global _enabled
+    _enabled = False
+
+
+def metrics_enabled() -> bool:
+    return _enabled
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.observe(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def span(name: str):
+    # with span("recommend.score"): ... records the block's wall time
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def increment(name: str, value: int = 1) -> None:
+    if _enabled:
+        metrics.increment(name, value)
+
+
+def observe(name: str, ms: float) -> None:
+    if _enabled:
+        metrics.observe(name, ms)
+
+
+def drain_metrics() -> Optional[Dict]:
+    return metrics.drain() if _enabled else None
+
+
+def dump_metrics(path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(metrics.snapshot(), f, indent=2)
+    logging.info(f"Metrics written to {path}")
+
+
+class SamplingProfiler:
+    # Samples the stack of one thread from a background thread and counts
+    # collapsed stacks, the input format of flamegraph.pl and speedscope
+    def __init__(self, interval: float = PROFILE_INTERVAL, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path: Path) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"{sum(self.samples.values())} profile samples written to {path}")
+
+
+@contextmanager
+def profile(path: Optional[Path], interval: float = PROFILE_INTERVAL) -> Iterator[None]:
+    # No-op without a path, so call sites can pass an optional CLI flag through
+    if path is None:
+        yield
+        return
+    profiler = SamplingProfiler(interval).start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.write(path)
@@ -0,0 +1,173 @@
+from dataclasses import dataclass
+from hashlib import blake2b
+import logging
+from pathlib import Path
+import pickle
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from matrix_store import replace_atomically
+
+# Separates name and artist inside a hashed song key
+KEY_SEP: str = "\x1f"
+HASHED_INDEX_ARRAYS = (
+    "song_hashes",
+    "song_rows",
+    "artist_hashes",
+    "artist_bounds",
+    "artist_order",
+)
+
+
+def normalize_key(text: str) -> str:
+    return str(text).lower().strip()
+
+
+def key_hash(key: str) -> np.uint64:
+    return np.uint64(int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little"))
+
+
+def key_hashes(keys: Iterable[str], count: int) -> np.ndarray:
+    return np.fromiter((key_hash(key) for key in keys), dtype=np.uint64, count=count)
+
+
+@dataclass(frozen=True, slots=True)
+class SongIndex:
+    # (name, artist) -> first catalog row with that pair
+    song_rows: Dict[Tuple[str, str], int]
+    # artist -> [start, stop) slice of artist_order
+    artist_ranges: Dict[str, Tuple[int, int]]
+    # Catalog rows grouped by artist, catalog order kept within each artist
+    artist_order: np.ndarray
+    n_rows: int
+
+    def find(self, name: str, artist: str) -> Optional[int]:
+        return self.song_rows.get((normalize_key(name), normalize_key(artist)))
+
+    def has_artist(self, artist: str) -> bool:
+        return normalize_key(artist) in self.artist_ranges
+
+    def artist_rows(self, artist: str) -> np.ndarray:
+        start, stop = self.artist_ranges.get(normalize_key(artist), (0, 0))
+        return self.artist_order[start:stop]
+
+
+def build_song_index(df: pd.DataFrame) -> SongIndex:
+    names = df["name"].astype(object).fillna("").map(normalize_key).tolist()
+    artists = df["artist"].astype(object).fillna("").map(normalize_key)
+    n_rows = len(df)
+
+    # Iterating in reverse lets the first occurrence of a duplicate pair win
+    song_rows = dict(zip(reversed(list(zip(names, artists))), range(n_rows - 1, -1, -1)))
+
+    codes, uniques = pd.factorize(artists)
+    artist_order = np.argsort(codes, kind="stable").astype(np.int32)
+    offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(uniques)), out=offsets[1:])
+    artist_ranges = {
+        artist: (int(offsets[i]), int(offsets[i + 1])) for i, artist in enumerate(uniques)
+    }
+
+    return SongIndex(song_rows, artist_ranges, artist_order, n_rows)
+
+
+@dataclass(frozen=True, slots=True)
+class HashedSongIndex:
+    # SongIndex as sorted 64-bit key hashes and plain arrays, so it can be
+    # memory-mapped instead of unpickling one dict entry per track. A query
+    # that is not in the catalog matches a stored hash with odds of about
+    # n_rows / 2**64, which is treated as never.
+    song_hashes: np.ndarray
+    song_rows: np.ndarray
+    artist_hashes: np.ndarray
+    # [start, stop) slice of artist_order for each entry of artist_hashes
+    artist_bounds: np.ndarray
+    artist_order: np.ndarray
+    n_rows: int
+
+    @staticmethod
+    def _position(hashes: np.ndarray, key: str) -> Optional[int]:
+        target = key_hash(key)
+        position = int(np.searchsorted(hashes, target))
+        if position < len(hashes) and hashes[position] == target:
+            return position
+        return None
+
+    def find(self, name: str, artist: str) -> Optional[int]:
+        position = self._position(
+            self.song_hashes, normalize_key(name) + KEY_SEP + normalize_key(artist)
+        )
+        return None if position is None else int(self.song_rows[position])
+
+    def has_artist(self, artist: str) -> bool:
+        return self._position(self.artist_hashes, normalize_key(artist)) is not None
+
+    def artist_rows(self, artist: str) -> np.ndarray:
+        position = self._position(self.artist_hashes, normalize_key(artist))
+        if position is None:
+            return self.artist_order[:0]
+        start, stop = self.artist_bounds[position]
+        return self.artist_order[start:stop]
+
+
+def hash_song_index(index: SongIndex) -> HashedSongIndex:
+    song_hashes = key_hashes(
+        (name + KEY_SEP + artist for name, artist in index.song_rows), len(index.song_rows)
+    )
+    song_rows = np.fromiter(index.song_rows.values(), dtype=np.int32, count=len(index.song_rows))
+    artist_hashes = key_hashes(index.artist_ranges, len(index.artist_ranges))
+    artist_bounds = np.array(list(index.artist_ranges.values()), dtype=np.int64).reshape(-1, 2)
+
+    song_sort = np.argsort(song_hashes, kind="stable")
+    artist_sort = np.argsort(artist_hashes, kind="stable")
+    return HashedSongIndex(
+        song_hashes[song_sort],
+        song_rows[song_sort],
+        artist_hashes[artist_sort],
+        artist_bounds[artist_sort],
+        index.artist_order,
+        index.n_rows,
+    )
+
+
+def save_hashed_song_index(index: HashedSongIndex, directory: Path) -> None:
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in HASHED_INDEX_ARRAYS:
+        np.save(directory / f"{name}.npy", getattr(index, name))
+
+
+def load_hashed_song_index(directory: Path, mmap: bool = True) -> HashedSongIndex:
+    directory = Path(directory)
+    mmap_mode = "r" if mmap else None
+    arrays = [
+        np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in HASHED_INDEX_ARRAYS
+    ]
+    # Every catalog row appears exactly once in artist_order
+    return HashedSongIndex(*arrays, n_rows=len(arrays[-1]))
+
+
+def save_song_index(index: SongIndex, path: Path) -> None:
+    with replace_atomically(path) as scratch, open(scratch, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    logging.info(f"Song index saved to {path}")
+
+
+def load_song_index(path: Path) -> SongIndex:
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_or_build_song_index(df: pd.DataFrame, path: Path, source_path: Path) -> SongIndex:
+    # Reuse the persisted index unless the catalog it was built from changed
+    path, source_path = Path(path), Path(source_path)
+    if path.exists() and path.stat().st_mtime >= source_path.stat().st_mtime:
+        index = load_song_index(path)
+        if index.n_rows == len(df):
+            return index
+
+    index = build_song_index(df)
+    save_song_index(index, path)
+    return index
@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+from typing import Iterator
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+CSR_COMPONENTS = ("data", "indices", "indptr")
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+@contextmanager
+def replace_atomically(path: Path) -> Iterator[Path]:
+    # Yields a scratch sibling of path (a file, or a directory the caller
+    # creates) that replaces path once the block succeeds. Writing in place
+    # would truncate files other processes have memory-mapped; after a rename
+    # they keep reading the old inode until they reload
+    path = Path(path)
+    scratch = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    _remove(scratch)
+    try:
+        yield scratch
+    except BaseException:
+        _remove(scratch)
+        raise
+    if not scratch.is_dir():
+        os.replace(scratch, path)
+        return
+    # A directory cannot be replaced in one rename. Files are never mixed
+    # between the old and new set, but between the two renames below path
+    # briefly does not exist, so a reader opening it then gets
+    # FileNotFoundError and has to retry
+    retired = path.with_name(path.name + ".old")
+    _remove(retired)
+    if path.exists():
+        path.rename(retired)
+    scratch.rename(path)
+    _remove(retired)
+
+
+def save_csr_arrays(matrix, directory: Path) -> None:
+    # Uncompressed .npy files can be memory-mapped straight from the page cache
+    directory = Path(directory)
+    matrix = csr_matrix(matrix)
+    with replace_atomically(directory) as scratch:
+        scratch.mkdir(parents=True)
+        for name in CSR_COMPONENTS:
+            np.save(scratch / f"{name}.npy", getattr(matrix, name))
+        with open(scratch / "shape.json", "w") as f:
+            json.dump(list(matrix.shape), f)
+    logging.info(f"CSR arrays saved to {directory}")
+
+
+def load_csr_arrays(directory: Path, mmap: bool = True) -> csr_matrix:
+    # With mmap the arrays stay read-only views of the files, so every worker
+    # process on the machine shares one copy instead of holding its own
+    directory = Path(directory)
+    mmap_mode = "r" if mmap else None
+    data, indices, indptr = (
+        np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in CSR_COMPONENTS
+    )
+    with open(directory / "shape.json") as f:
+        shape = tuple(json.load(f))
+
+    matrix = csr_matrix(shape, dtype=data.dtype)
+    # Assigning the components directly skips the constructor's index dtype
+    # negotiation, which could otherwise copy the mapped arrays
+    matrix.data, matrix.indices, matrix.indptr = data, indices, indptr
+    return matrix
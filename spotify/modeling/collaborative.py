@@ -0,0 +1,133 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from loguru import logger
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from spotify.config import CFPaths
+from spotify.matrix_store import load_csr_arrays, save_csr_arrays
+from spotify.ranking import top_k_rows
+
+# Tracks scored per block when precomputing neighbours; the dense score block
+# is NEIGHBOUR_BLOCK_SIZE * n_tracks * 4 bytes
+NEIGHBOUR_BLOCK_SIZE: int = 512
+N_NEIGHBOURS: int = 50
+
+HISTORY_COLS = ["track_id", "user_id", "playcount"]
+
+
+@dataclass(frozen=True, slots=True)
+class ItemNeighbours:
+    # Row i holds the top-N neighbour track codes of track code i, best first
+    indices: np.ndarray
+    scores: np.ndarray
+    track_ids: np.ndarray
+    track_codes: Dict[str, int]
+
+    def similar(self, track_id: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        code = self.track_codes.get(track_id)
+        if code is None:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+
+        # O(k) slice; zero scores mean no shared listeners and are dropped
+        indices, scores = self.indices[code, :k], self.scores[code, :k]
+        keep = scores > 0
+        return self.track_ids[indices[keep]], scores[keep]
+
+
+def build_interaction_matrix(history: pd.DataFrame) -> Tuple[csr_matrix, pd.Index, pd.Index]:
+    # Tracks x users play counts; duplicate (track, user) rows are summed
+    track_codes, track_ids = pd.factorize(history["track_id"])
+    user_codes, user_ids = pd.factorize(history["user_id"])
+    interactions = csr_matrix(
+        (history["playcount"].to_numpy(dtype=np.float32), (track_codes, user_codes)),
+        shape=(len(track_ids), len(user_ids)),
+    )
+    interactions.sum_duplicates()
+    return interactions, track_ids, user_ids
+
+
+def _normalize_rows(matrix: csr_matrix) -> csr_matrix:
+    normalized = matrix.astype(np.float32, copy=True)
+    norms = np.sqrt(np.asarray(normalized.multiply(normalized).sum(axis=1)).ravel())
+    inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized.data *= np.repeat(inv_norms, np.diff(normalized.indptr))
+    return normalized
+
+
+def iter_item_neighbours(
+    interactions: csr_matrix,
+    n_neighbours: int = N_NEIGHBOURS,
+    block_size: int = NEIGHBOUR_BLOCK_SIZE,
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    normalized = _normalize_rows(interactions)
+    normalized_t = normalized.T.tocsr()
+    n_tracks = normalized.shape[0]
+    for start in range(0, n_tracks, block_size):
+        stop = min(start + block_size, n_tracks)
+
+        # Cosine of a block of tracks against every track via shared listeners
+        block_scores = (normalized[start:stop] @ normalized_t).toarray()
+        indices, scores = top_k_rows(block_scores, n_neighbours, exclude=np.arange(start, stop))
+        yield start, indices.astype(np.int32), scores.astype(np.float32)
+
+
+def compute_item_neighbours(
+    interactions: csr_matrix,
+    n_neighbours: int = N_NEIGHBOURS,
+    block_size: int = NEIGHBOUR_BLOCK_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    n_tracks = interactions.shape[0]
+    width = min(n_neighbours, max(n_tracks - 1, 0))
+    indices = np.zeros((n_tracks, width), dtype=np.int32)
+    scores = np.zeros((n_tracks, width), dtype=np.float32)
+    for start, block_indices, block_scores in iter_item_neighbours(
+        interactions, n_neighbours, block_size
+    ):
+        indices[start : start + len(block_indices)] = block_indices
+        scores[start : start + len(block_scores)] = block_scores
+    return indices, scores
+
+
+def save_id_mapping(ids, path: Path, column: str) -> None:
+    pd.DataFrame({column: np.asarray(ids)}).to_parquet(path, index=False)
+
+
+def load_id_mapping(path: Path, column: str) -> np.ndarray:
+    return pd.read_parquet(path, columns=[column])[column].to_numpy()
+
+
+def save_cf_model(
+    paths: CFPaths,
+    interactions: Optional[csr_matrix],
+    track_ids,
+    user_ids,
+    neighbour_indices: np.ndarray,
+    neighbour_scores: np.ndarray,
+) -> None:
+    # interactions is None when the out-of-core builder already wrote them
+    paths.model_dir.mkdir(parents=True, exist_ok=True)
+    if interactions is not None:
+        save_csr_arrays(interactions, paths.interactions)
+    save_id_mapping(track_ids, paths.track_ids, "track_id")
+    save_id_mapping(user_ids, paths.user_ids, "user_id")
+    np.savez(paths.neighbours, indices=neighbour_indices, scores=neighbour_scores)
+    logger.info(f"Collaborative filtering model saved to {paths.model_dir}")
+
+
+def load_interactions(paths: CFPaths, mmap: bool = True) -> csr_matrix:
+    return load_csr_arrays(paths.interactions, mmap=mmap)
+
+
+def load_item_neighbours(paths: CFPaths, max_neighbours: Optional[int] = None) -> ItemNeighbours:
+    with np.load(paths.neighbours) as arrays:
+        indices, scores = arrays["indices"], arrays["scores"]
+    if max_neighbours is not None:
+        indices, scores = indices[:, :max_neighbours], scores[:, :max_neighbours]
+
+    track_ids = load_id_mapping(paths.track_ids, "track_id")
+    track_codes = dict(zip(track_ids, range(len(track_ids))))
+    return ItemNeighbours(indices, scores, track_ids, track_codes)
@@ -0,0 +1,184 @@
+import json
+from pathlib import Path
+import resource
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from spotify.matrix_store import load_csr_arrays
+from spotify.modeling.collaborative import HISTORY_COLS
+
+# Rows of User Listening History.csv read per chunk
+CHUNK_SIZE: int = 1_000_000
+# Track rows compacted per block when merging shards
+MERGE_BLOCK_ROWS: int = 65_536
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def encode_ids(values: pd.Series, codes: Dict[str, int]) -> np.ndarray:
+    # Factorize the chunk first so the dictionary is probed once per distinct id
+    local_codes, uniques = pd.factorize(values)
+    mapped = np.fromiter(
+        (codes.setdefault(value, len(codes)) for value in uniques),
+        dtype=np.int64,
+        count=len(uniques),
+    )
+    return mapped[local_codes]
+
+
+def _write_shard(path: Path, rows: np.ndarray, cols: np.ndarray, data: np.ndarray) -> np.ndarray:
+    # Pre-aggregate repeated (track, user) pairs inside the chunk
+    keys = (rows << 32) | cols
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.bincount(inverse, weights=data).astype(np.float32)
+    shard_rows = (unique_keys >> 32).astype(np.int32)
+    np.savez(path, rows=shard_rows, cols=(unique_keys & 0xFFFFFFFF).astype(np.int32), data=summed)
+    return shard_rows
+
+
+def _scatter_shards(
+    shard_paths: List[Path],
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    data: np.ndarray,
+) -> None:
+    # Each shard's entries are placed at the next free slots of their rows
+    next_free = indptr[:-1].copy()
+    for shard_path in shard_paths:
+        with np.load(shard_path) as shard:
+            rows, cols, values = shard["rows"], shard["cols"], shard["data"]
+        order = np.argsort(rows, kind="stable")
+        rows, cols, values = rows[order], cols[order], values[order]
+
+        counts = np.bincount(rows, minlength=len(next_free))
+        row_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = next_free[rows] + (np.arange(len(rows)) - row_starts)
+        indices[positions] = cols
+        data[positions] = values
+        next_free += counts
+
+
+def _compact_rows(
+    n_rows: int,
+    n_cols: int,
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    data: np.ndarray,
+) -> np.ndarray:
+    # Sort columns and sum cross-chunk duplicates block by block, in place.
+    # Writes never overtake reads because compaction only shrinks rows.
+    new_indptr = np.zeros_like(indptr)
+    write_pos = 0
+    for start in range(0, n_rows, MERGE_BLOCK_ROWS):
+        stop = min(start + MERGE_BLOCK_ROWS, n_rows)
+        lo, hi = indptr[start], indptr[stop]
+        block = csr_matrix(
+            (np.array(data[lo:hi]), np.array(indices[lo:hi]), indptr[start : stop + 1] - lo),
+            shape=(stop - start, n_cols),
+        )
+        block.sum_duplicates()
+
+        indices[write_pos : write_pos + block.nnz] = block.indices
+        data[write_pos : write_pos + block.nnz] = block.data
+        new_indptr[start + 1 : stop + 1] = write_pos + block.indptr[1:]
+        write_pos += block.nnz
+    return new_indptr
+
+
+def build_interactions_out_of_core(
+    history_path: Path,
+    output_dir: Path,
+    chunksize: int = CHUNK_SIZE,
+    track_ids: Optional[Iterable[str]] = None,
+    user_ids: Optional[Iterable[str]] = None,
+) -> Tuple[csr_matrix, np.ndarray, np.ndarray, Dict[str, float]]:
+    # Existing id mappings can be passed in to keep codes stable across rebuilds
+    track_codes = {track_id: code for code, track_id in enumerate(track_ids or [])}
+    user_codes = {user_id: code for code, user_id in enumerate(user_ids or [])}
+
+    output_dir = Path(output_dir)
+    shard_dir = output_dir.with_name(output_dir.name + "_shards")
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    start_time = time.perf_counter()
+    n_interactions = 0
+    shard_paths = []
+    row_counts = np.zeros(0, dtype=np.int64)
+    chunks = pd.read_csv(
+        history_path, usecols=HISTORY_COLS, chunksize=chunksize, dtype={"playcount": np.float32}
+    )
+    for i, chunk in enumerate(chunks):
+        rows = encode_ids(chunk["track_id"], track_codes)
+        cols = encode_ids(chunk["user_id"], user_codes)
+
+        shard_path = shard_dir / f"shard_{i:05d}.npz"
+        shard_rows = _write_shard(shard_path, rows, cols, chunk["playcount"].to_numpy())
+        shard_paths.append(shard_path)
+
+        # Running per-track counts give the CSR row pointers without a re-read
+        shard_counts = np.bincount(shard_rows, minlength=len(track_codes))
+        row_counts = np.pad(row_counts, (0, len(shard_counts) - len(row_counts)))
+        row_counts += shard_counts
+
+        n_interactions += len(chunk)
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"chunk {i}: {n_interactions:,} rows | {n_interactions / elapsed:,.0f} rows/s | "
+            f"peak RSS {peak_rss_mb():,.0f} MB"
+        )
+
+    n_rows, n_cols = len(track_codes), len(user_codes)
+    raw_nnz = int(row_counts.sum())
+    index_dtype = np.int32 if max(raw_nnz, n_cols) < np.iinfo(np.int32).max else np.int64
+
+    # Merge the COO shards into CSR arrays memory-mapped on disk
+    output_dir.mkdir(parents=True, exist_ok=True)
+    indptr = np.zeros(n_rows + 1, dtype=index_dtype)
+    np.cumsum(row_counts, out=indptr[1:])
+    indices = np.lib.format.open_memmap(
+        shard_dir / "indices.npy", mode="w+", dtype=index_dtype, shape=(raw_nnz,)
+    )
+    data = np.lib.format.open_memmap(
+        shard_dir / "data.npy", mode="w+", dtype=np.float32, shape=(raw_nnz,)
+    )
+    _scatter_shards(shard_paths, indptr, indices, data)
+    indptr = _compact_rows(n_rows, n_cols, indptr, indices, data)
+    nnz = int(indptr[-1])
+
+    np.save(output_dir / "indices.npy", indices[:nnz])
+    np.save(output_dir / "data.npy", data[:nnz])
+    np.save(output_dir / "indptr.npy", indptr)
+    with open(output_dir / "shape.json", "w") as f:
+        json.dump([n_rows, n_cols], f)
+    del indices, data
+    shutil.rmtree(shard_dir)
+
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        "n_interactions": n_interactions,
+        "n_tracks": n_rows,
+        "n_users": n_cols,
+        "nnz": nnz,
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(n_interactions / elapsed, 1) if elapsed else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    logger.info(
+        f"Built {n_rows:,} x {n_cols:,} CSR with {nnz:,} non-zeros in {elapsed:.1f}s "
+        f"({stats['rows_per_second']:,.0f} rows/s, peak RSS {stats['peak_rss_mb']:,.0f} MB)"
+    )
+    return (
+        load_csr_arrays(output_dir),
+        np.array(list(track_codes), dtype=object),
+        np.array(list(user_codes), dtype=object),
+        stats,
+    )
@@ -1,29 +1,76 @@
 from pathlib import Path
 
 from loguru import logger
-from tqdm import tqdm
+import numpy as np
+import pandas as pd
 import typer
 
-from spotify.config import MODELS_DIR, PROCESSED_DATA_DIR
+from spotify.catalog import DISPLAY_COLS, load_catalog
+from spotify.config import CF_MODELS_DIR, PROCESSED_DATA_DIR, CFPaths
+from spotify.modeling.als import ALSFactors, load_als_factors, similar_items
+from spotify.modeling.collaborative import (
+    ItemNeighbours,
+    load_id_mapping,
+    load_item_neighbours,
+)
 
 app = typer.Typer()
 
 
+def recommend_similar_tracks(
+    track_id: str,
+    neighbours: ItemNeighbours,
+    catalog: pd.DataFrame,
+    k: int = 10,
+) -> pd.DataFrame:
+    # Served from the precomputed neighbour table; no similarity is recomputed
+    track_ids, scores = neighbours.similar(track_id, k)
+    results = pd.DataFrame({"track_id": track_ids, "similarity_score": scores})
+    return results.merge(catalog, on="track_id", how="left")
+
+
+def recommend_with_als(
+    track_id: str,
+    factors: ALSFactors,
+    track_ids: np.ndarray,
+    catalog: pd.DataFrame,
+    k: int = 10,
+) -> pd.DataFrame:
+    # Dense dot product against the item factors plus partial top-k selection
+    codes = np.flatnonzero(track_ids == track_id)
+    if len(codes):
+        indices, scores = similar_items(factors, int(codes[0]), k)
+    else:
+        indices, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    results = pd.DataFrame({"track_id": track_ids[indices], "similarity_score": scores})
+    return results.merge(catalog, on="track_id", how="left")
+
+
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    features_path: Path = PROCESSED_DATA_DIR / "test_features.csv",
-    model_path: Path = MODELS_DIR / "model.pkl",
-    predictions_path: Path = PROCESSED_DATA_DIR / "test_predictions.csv",
-    # -----------------------------------------
+    track_id: str,
+    k: int = 10,
+    model_dir: Path = CF_MODELS_DIR,
+    catalog_path: Path = PROCESSED_DATA_DIR / "cleaned_data.parquet",
+    als: bool = typer.Option(False, help="Score with the ALS factors."),
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Performing inference for model...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
+    paths = CFPaths(model_dir)
+    catalog = load_catalog(catalog_path, columns=["track_id", *DISPLAY_COLS])
+
+    if als:
+        track_ids = load_id_mapping(paths.track_ids, "track_id")
+        factors = load_als_factors(paths.als_factors)
+        recommendations = recommend_with_als(track_id, factors, track_ids, catalog, k)
+    else:
+        neighbours = load_item_neighbours(paths)
+        recommendations = recommend_similar_tracks(track_id, neighbours, catalog, k)
+    if recommendations.empty:
+        logger.warning(f"Track '{track_id}' has no listening history.")
+        return
+
+    for rank, row in enumerate(recommendations.itertuples(), start=1):
+        logger.info(f"{rank:2d}. {row.name} by {row.artist} (score {row.similarity_score:.4f})")
     logger.success("Inference complete.")
-    # -----------------------------------------
 
 
 if __name__ == "__main__":
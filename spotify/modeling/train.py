@@ -1,29 +1,101 @@
+import json
 from pathlib import Path
 
 from loguru import logger
-from tqdm import tqdm
+import pandas as pd
 import typer
 
-from spotify.config import MODELS_DIR, PROCESSED_DATA_DIR
+from spotify.config import CF_MODELS_DIR, RAW_DATA_DIR, CFPaths
+from spotify.matrix_store import save_csr_arrays
+from spotify.modeling.als import (
+    N_FACTORS,
+    N_ITERATIONS,
+    REGULARIZATION,
+    benchmark_against_item_cosine,
+    save_als_factors,
+    train_als,
+)
+from spotify.modeling.collaborative import (
+    HISTORY_COLS,
+    N_NEIGHBOURS,
+    NEIGHBOUR_BLOCK_SIZE,
+    build_interaction_matrix,
+    compute_item_neighbours,
+    save_cf_model,
+    save_id_mapping,
+)
+from spotify.modeling.interactions import CHUNK_SIZE, build_interactions_out_of_core
 
 app = typer.Typer()
 
 
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    features_path: Path = PROCESSED_DATA_DIR / "features.csv",
-    labels_path: Path = PROCESSED_DATA_DIR / "labels.csv",
-    model_path: Path = MODELS_DIR / "model.pkl",
-    # -----------------------------------------
+    history_path: Path = RAW_DATA_DIR / "User Listening History.csv",
+    model_dir: Path = CF_MODELS_DIR,
+    n_neighbours: int = N_NEIGHBOURS,
+    block_size: int = NEIGHBOUR_BLOCK_SIZE,
+    streaming: bool = typer.Option(False, help="Build the matrix out of core in chunks."),
+    chunksize: int = CHUNK_SIZE,
+    als: bool = typer.Option(False, help="Fit ALS factors instead of the neighbour table."),
+    n_factors: int = N_FACTORS,
+    n_iterations: int = N_ITERATIONS,
+    reg: float = REGULARIZATION,
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Training some model...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Modeling training complete.")
-    # -----------------------------------------
+    paths = CFPaths(model_dir)
+    if streaming:
+        logger.info(f"Streaming listening history from {history_path} ...")
+        interactions, track_ids, user_ids, stats = build_interactions_out_of_core(
+            history_path, paths.interactions, chunksize
+        )
+        paths.model_dir.mkdir(parents=True, exist_ok=True)
+        with open(paths.build_stats, "w") as f:
+            json.dump(stats, f, indent=2)
+    else:
+        logger.info(f"Loading listening history from {history_path} ...")
+        history = pd.read_csv(history_path, usecols=HISTORY_COLS)
+
+        logger.info("Building the track x user interaction matrix ...")
+        interactions, track_ids, user_ids = build_interaction_matrix(history)
+    logger.info(
+        f"{interactions.shape[0]:,} tracks x {interactions.shape[1]:,} users, "
+        f"{interactions.nnz:,} interactions"
+    )
+
+    if als:
+        logger.info(f"Fitting implicit ALS with {n_factors} factors ...")
+        factors, history = train_als(interactions, n_factors, n_iterations, reg)
+
+        paths.model_dir.mkdir(parents=True, exist_ok=True)
+        if not streaming:
+            save_csr_arrays(interactions, paths.interactions)
+        save_id_mapping(track_ids, paths.track_ids, "track_id")
+        save_id_mapping(user_ids, paths.user_ids, "user_id")
+        save_als_factors(factors, paths.als_factors)
+
+        report = {
+            "convergence": history,
+            "scoring": benchmark_against_item_cosine(interactions, factors),
+        }
+        with open(paths.als_report, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.success("ALS training complete.")
+        return
+
+    logger.info(f"Precomputing the top-{n_neighbours} item neighbours ...")
+    neighbour_indices, neighbour_scores = compute_item_neighbours(
+        interactions, n_neighbours, block_size
+    )
+
+    save_cf_model(
+        paths,
+        None if streaming else interactions,
+        track_ids,
+        user_ids,
+        neighbour_indices,
+        neighbour_scores,
+    )
+    logger.success("Collaborative filtering training complete.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+import argparse
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import Deque, Dict, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from ann import N_PROBE, IVFIndex, load_ivf_index, probe_ivf_lists
+from catalog import DISPLAY_COLS, load_catalog
+from config import CFPaths
+from content_filtering import Paths
+from instrumentation import configure_logging
+from lookup import SongIndex, load_song_index, normalize_key
+from matrix_store import load_csr_arrays
+from ranking import select_top_k
+
+# Per-generator caps; the re-ranker scores at most MAX_CANDIDATES rows
+ARTIST_CANDIDATES: int = 100
+TAG_CANDIDATES: int = 200
+# Posting entries visited per query, rarest tags first
+TAG_POSTINGS_BUDGET: int = 20_000
+MAX_CANDIDATES: int = 500
+
+# Same tokenization as the TF-IDF block of the feature transformer
+TAG_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+# Requests kept per stage for the latency percentiles
+LATENCY_WINDOW: int = 10_000
+
+
+class CandidateGenerator(Protocol):
+    name: str
+
+    def __call__(self, query_idx: int) -> np.ndarray: ...
+
+
+class Reranker(Protocol):
+    def __call__(self, query_idx: int, candidates: np.ndarray) -> np.ndarray: ...
+
+
+@dataclass(frozen=True, slots=True)
+class SameArtistCandidates:
+    song_index: SongIndex
+    # Normalized artist key of every catalog row
+    row_artists: np.ndarray
+    limit: int = ARTIST_CANDIDATES
+    name: str = "artist"
+
+    def __call__(self, query_idx: int) -> np.ndarray:
+        return self.song_index.artist_rows(self.row_artists[query_idx])[: self.limit]
+
+
+@dataclass(frozen=True, slots=True)
+class TagCandidates:
+    # rows x tag terms (binary) and its transpose, the posting lists
+    row_terms: csr_matrix
+    postings: csr_matrix
+    idf: np.ndarray
+    limit: int = TAG_CANDIDATES
+    budget: int = TAG_POSTINGS_BUDGET
+    name: str = "tags"
+
+    def __call__(self, query_idx: int) -> np.ndarray:
+        terms = self.row_terms[query_idx].indices
+        terms = terms[np.argsort(-self.idf[terms], kind="stable")]
+
+        # Walk posting lists from the rarest tag until the budget is spent,
+        # so one very common tag cannot turn this into a catalog scan
+        lengths = np.diff(self.postings.indptr)[terms]
+        n_terms = max(1, int(np.searchsorted(np.cumsum(lengths), self.budget, side="right")))
+        terms, lengths = terms[:n_terms], lengths[:n_terms]
+        rows = (
+            np.concatenate(
+                [
+                    self.postings.indices[self.postings.indptr[t] : self.postings.indptr[t + 1]]
+                    for t in terms
+                ]
+            )
+            if len(terms)
+            else np.empty(0, dtype=np.int32)
+        )
+        rows = rows[: self.budget]
+
+        # Rank by the summed idf of shared tags
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        weights = np.repeat(self.idf[terms], lengths)[: len(rows)]
+        shared = np.bincount(inverse, weights=weights, minlength=len(unique_rows))
+        top, _ = select_top_k(shared, self.limit)
+        return unique_rows[top]
+
+
+@dataclass(frozen=True, slots=True)
+class ANNCandidates:
+    index: IVFIndex
+    normalized: csr_matrix
+    n_probe: int = N_PROBE
+    name: str = "ann"
+
+    def __call__(self, query_idx: int) -> np.ndarray:
+        return probe_ivf_lists(self.index, self.normalized, query_idx, self.n_probe)
+
+
+@dataclass(frozen=True, slots=True)
+class NeighbourCandidates:
+    # Catalog row -> CF neighbour catalog rows, -1 padded
+    table: np.ndarray
+    name: str = "cf"
+
+    def __call__(self, query_idx: int) -> np.ndarray:
+        neighbours = self.table[query_idx]
+        return neighbours[neighbours >= 0]
+
+
+@dataclass(frozen=True, slots=True)
+class ExactReranker:
+    normalized: csr_matrix
+
+    def __call__(self, query_idx: int, candidates: np.ndarray) -> np.ndarray:
+        return self.normalized[candidates] @ self.normalized[query_idx].toarray().ravel()
+
+
+@dataclass(slots=True)
+class LatencyTracker:
+    window: int = LATENCY_WINDOW
+    samples: Dict[str, Deque[float]] = field(default_factory=dict)
+
+    def record(self, stage: str, seconds: float) -> None:
+        if stage not in self.samples:
+            self.samples[stage] = deque(maxlen=self.window)
+        self.samples[stage].append(seconds * 1000)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for stage, samples in self.samples.items():
+            p50, p95, p99 = np.percentile(np.fromiter(samples, dtype=float), [50, 95, 99])
+            report[stage] = {"count": len(samples), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+        return report
+
+
+@dataclass(slots=True)
+class RecommendationPipeline:
+    generators: Sequence[CandidateGenerator]
+    reranker: Reranker
+    max_candidates: int = MAX_CANDIDATES
+    latency: LatencyTracker = field(default_factory=LatencyTracker)
+
+    def recommend(self, query_idx: int, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        start = time.perf_counter()
+        pools = []
+        for generator in self.generators:
+            stage_start = time.perf_counter()
+            pools.append(np.asarray(generator(query_idx), dtype=np.intp))
+            self.latency.record(generator.name, time.perf_counter() - stage_start)
+
+        # Generators are listed in priority order, so the cap keeps the earlier pools
+        stage_start = time.perf_counter()
+        merged = np.concatenate(pools) if pools else np.empty(0, dtype=np.intp)
+        _, first_seen = np.unique(merged, return_index=True)
+        candidates = merged[np.sort(first_seen)]
+        candidates = candidates[candidates != query_idx][: self.max_candidates]
+        self.latency.record("merge", time.perf_counter() - stage_start)
+
+        stage_start = time.perf_counter()
+        scores = self.reranker(query_idx, candidates)
+        positions, top_scores = select_top_k(scores, k)
+        self.latency.record("rerank", time.perf_counter() - stage_start)
+
+        self.latency.record("total", time.perf_counter() - start)
+        return candidates[positions], top_scores
+
+
+def build_tag_candidates(tags: pd.Series, limit: int = TAG_CANDIDATES) -> TagCandidates:
+    tokens = tags.astype(object).fillna("").str.lower().str.findall(TAG_TOKEN_PATTERN)
+    exploded = tokens.explode().dropna()
+    rows = exploded.index.to_numpy()
+    term_codes, terms = pd.factorize(exploded)
+
+    row_terms = csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, term_codes)),
+        shape=(len(tags), len(terms)),
+    )
+    row_terms.sum_duplicates()
+    row_terms.data[:] = 1.0
+    doc_freq = np.diff(row_terms.tocsc().indptr)
+    idf = np.log(len(tags) / np.maximum(doc_freq, 1)) + 1.0
+    return TagCandidates(row_terms, row_terms.T.tocsr(), idf, limit)
+
+
+def align_neighbour_table(
+    catalog_track_ids: pd.Series,
+    cf_track_ids: np.ndarray,
+    neighbour_indices: np.ndarray,
+    neighbour_scores: np.ndarray,
+) -> np.ndarray:
+    # Translate CF track codes to catalog rows on both axes
+    code_to_row = pd.Index(catalog_track_ids).get_indexer(cf_track_ids).astype(np.int32)
+    row_to_code = pd.Index(cf_track_ids).get_indexer(catalog_track_ids)
+
+    # Zero-score padding (no shared listeners) becomes -1 like unknown tracks
+    neighbour_rows = np.where(neighbour_scores > 0, code_to_row[neighbour_indices], -1)
+    table = np.full((len(catalog_track_ids), neighbour_indices.shape[1]), -1, dtype=np.int32)
+    has_listens = row_to_code >= 0
+    table[has_listens] = neighbour_rows[row_to_code[has_listens]]
+    return table
+
+
+def build_default_pipeline(
+    raw_df: pd.DataFrame,
+    normalized: csr_matrix,
+    song_index: SongIndex,
+    ann_index: Optional[IVFIndex] = None,
+    neighbour_table: Optional[np.ndarray] = None,
+) -> RecommendationPipeline:
+    row_artists = raw_df["artist"].astype(object).fillna("").map(normalize_key).to_numpy()
+    generators: List[CandidateGenerator] = [
+        SameArtistCandidates(song_index, row_artists),
+        build_tag_candidates(raw_df["tags"]),
+    ]
+    if neighbour_table is not None:
+        generators.append(NeighbourCandidates(neighbour_table))
+    if ann_index is not None:
+        generators.append(ANNCandidates(ann_index, normalized))
+    return RecommendationPipeline(generators, ExactReranker(normalized))
+
+
+def get_pipeline_recommendations(
+    query_name: str,
+    query_artist: str,
+    raw_df: pd.DataFrame,
+    pipeline: RecommendationPipeline,
+    song_index: SongIndex,
+    top_k: int = 10,
+) -> pd.DataFrame:
+    query_idx = song_index.find(query_name, query_artist)
+    if query_idx is None:
+        raise ValueError(f"Song '{query_name}' by '{query_artist}' not found.")
+
+    ranked, scores = pipeline.recommend(query_idx, top_k)
+    recommendations = raw_df.iloc[ranked][DISPLAY_COLS].reset_index(drop=True)
+    recommendations["score"] = scores
+    return recommendations
+
+
+def main(n_queries: int = 500, k: int = 10, seed: int = 42):
+    paths = Paths()
+    raw_df = load_catalog(paths.cleaned_catalog, columns=["track_id", "artist", "tags"])
+    normalized = load_csr_arrays(paths.normalized_arrays)
+    song_index = load_song_index(paths.song_index)
+
+    ann_index = load_ivf_index(paths.ann_index) if paths.ann_index.exists() else None
+    neighbour_table = None
+    # Written by python -m spotify.modeling.train
+    cf_paths = CFPaths()
+    if cf_paths.neighbours.exists():
+        with np.load(cf_paths.neighbours) as arrays:
+            neighbour_indices, neighbour_scores = arrays["indices"], arrays["scores"]
+        cf_track_ids = pd.read_parquet(cf_paths.track_ids, columns=["track_id"])["track_id"]
+        neighbour_table = align_neighbour_table(
+            raw_df["track_id"], cf_track_ids.to_numpy(), neighbour_indices, neighbour_scores
+        )
+    pipeline = build_default_pipeline(raw_df, normalized, song_index, ann_index, neighbour_table)
+    logging.info(f"Candidate generators: {[generator.name for generator in pipeline.generators]}")
+
+    # Recall of the two-stage results against exhaustive top-k
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(normalized.shape[0], min(n_queries, normalized.shape[0]), replace=False)
+    hits = 0
+    for query_idx in queries:
+        ranked, _ = pipeline.recommend(int(query_idx), k)
+        exact, _ = select_top_k(
+            normalized @ normalized[query_idx].toarray().ravel(), k, exclude=int(query_idx)
+        )
+        hits += np.intersect1d(ranked, exact).size
+
+    logging.info(f"recall@{k} vs exhaustive ranking: {hits / (len(queries) * k):.3f}")
+    for stage, stats in pipeline.latency.report().items():
+        logging.info(
+            f"{stage:>8}: p50 {stats['p50_ms']:.3f} ms | p95 {stats['p95_ms']:.3f} ms | "
+            f"p99 {stats['p99_ms']:.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Evaluate the two-stage pipeline.")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    main(n_queries=args.queries, k=args.k)
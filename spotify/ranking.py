@@ -0,0 +1,76 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def select_top_k(
+    scores: np.ndarray,
+    k: int,
+    exclude: Optional[int] = None,
+    mask: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns (indices, scores) of the k best entries, best first; with a
+    # boolean mask only the allowed entries compete
+    scores = np.asarray(scores).ravel()
+    if mask is not None:
+        allowed = np.flatnonzero(mask)
+        if exclude is not None:
+            allowed = allowed[allowed != exclude]
+        positions, top_scores = select_top_k(scores[allowed], k)
+        return allowed[positions], top_scores
+    n_items = scores.shape[0]
+    k = min(k, n_items - (exclude is not None))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=scores.dtype)
+
+    # Partially select one extra candidate so the excluded row can be dropped
+    n_select = min(k + (exclude is not None), n_items)
+    if n_select < n_items:
+        candidates = np.argpartition(scores, -n_select)[-n_select:]
+    else:
+        candidates = np.arange(n_items)
+
+    if exclude is not None:
+        candidates = candidates[candidates != exclude]
+
+    # Only the small candidate slice gets a full sort
+    order = np.argsort(-scores[candidates], kind="stable")[:k]
+    indices = candidates[order]
+    return indices, scores[indices]
+
+
+def top_k_rows(
+    scores: np.ndarray,
+    k: int,
+    exclude: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Row-wise select_top_k over a dense (n_queries, n_items) score block;
+    # exclude holds one column per row to drop, e.g. each query's own track
+    scores = np.asarray(scores)
+    n_rows, n_items = scores.shape
+    k = min(k, n_items - (exclude is not None))
+    if k <= 0:
+        return (
+            np.empty((n_rows, 0), dtype=np.intp),
+            np.empty((n_rows, 0), dtype=scores.dtype),
+        )
+
+    n_select = min(k + (exclude is not None), n_items)
+    if n_select < n_items:
+        candidates = np.argpartition(scores, -n_select, axis=1)[:, -n_select:]
+    else:
+        candidates = np.tile(np.arange(n_items), (n_rows, 1))
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    candidates = np.take_along_axis(candidates, order, axis=1)
+
+    if exclude is not None:
+        # Push each row's excluded column to the end without copying the block
+        is_excluded = candidates == np.asarray(exclude).reshape(-1, 1)
+        candidates = np.take_along_axis(
+            candidates, np.argsort(is_excluded, axis=1, kind="stable"), axis=1
+        )
+
+    indices = candidates[:, :k]
+    return indices, np.take_along_axis(scores, indices, axis=1)
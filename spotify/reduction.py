@@ -0,0 +1,142 @@
+import json
+import logging
+from pathlib import Path
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from matrix_store import replace_atomically
+from ranking import select_top_k
+
+REDUCED_DIM: int = 64
+REDUCTION_METHODS: Tuple[str, ...] = ("svd", "projection")
+EMBEDDING_DTYPES: Tuple[str, ...] = ("float32", "float16")
+# float16 has no BLAS kernels, so it is upcast and scored this many rows at a time
+SCORE_BLOCK_ROWS: int = 65_536
+
+
+def fit_reduction(
+    normalized,
+    dim: int = REDUCED_DIM,
+    method: str = "svd",
+    seed: int = 42,
+) -> np.ndarray:
+    # Returns an n_features x dim projection matrix
+    n_features = normalized.shape[1]
+    dim = min(dim, n_features - 1)
+    if method == "svd":
+        from sklearn.decomposition import TruncatedSVD
+
+        svd = TruncatedSVD(n_components=dim, random_state=seed).fit(normalized)
+        logging.info(f"SVD keeps {svd.explained_variance_ratio_.sum():.1%} of the variance")
+        return svd.components_.T.astype(np.float32)
+    if method == "projection":
+        rng = np.random.default_rng(seed)
+        return (rng.standard_normal((n_features, dim)) / np.sqrt(dim)).astype(np.float32)
+    raise ValueError(f"Unknown reduction method '{method}'; expected one of {REDUCTION_METHODS}.")
+
+
+def embed_rows(normalized, components: np.ndarray, dtype: str = "float32") -> np.ndarray:
+    # Unit-length rows, so a dot product in the reduced space is still a cosine
+    embedded = np.asarray(normalized @ components, dtype=np.float32)
+    norms = np.linalg.norm(embedded, axis=1, keepdims=True)
+    embedded = np.divide(embedded, norms, out=np.zeros_like(embedded), where=norms > 0)
+    return embedded.astype(dtype)
+
+
+def score_dense(embeddings: np.ndarray, query: np.ndarray) -> np.ndarray:
+    query = np.asarray(query, dtype=np.float32).ravel()
+    if embeddings.dtype == np.float32:
+        return embeddings @ query
+    scores = np.empty(embeddings.shape[0], dtype=np.float32)
+    for start in range(0, embeddings.shape[0], SCORE_BLOCK_ROWS):
+        block = embeddings[start : start + SCORE_BLOCK_ROWS]
+        scores[start : start + len(block)] = block.astype(np.float32) @ query
+    return scores
+
+
+def score_dense_block(embeddings: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    # (n_queries, n_items) scores for a block of queries, upcasting float16
+    # rows SCORE_BLOCK_ROWS at a time like score_dense
+    queries = np.asarray(queries, dtype=np.float32)
+    if embeddings.dtype == np.float32:
+        return queries @ embeddings.T
+    scores = np.empty((queries.shape[0], embeddings.shape[0]), dtype=np.float32)
+    for start in range(0, embeddings.shape[0], SCORE_BLOCK_ROWS):
+        block = embeddings[start : start + SCORE_BLOCK_ROWS]
+        scores[:, start : start + len(block)] = queries @ block.astype(np.float32).T
+    return scores
+
+
+def save_embeddings(embeddings: np.ndarray, components: np.ndarray, directory: Path) -> None:
+    # Plain .npy so serving workers can memory-map the embeddings
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # File by file, so reports stored next to the embeddings survive an ingest
+    for name, array in (("components", components), ("embeddings", embeddings)):
+        with replace_atomically(directory / f"{name}.npy") as scratch:
+            np.save(scratch, array)
+    logging.info(
+        f"{embeddings.shape[0]} x {embeddings.shape[1]} {embeddings.dtype} "
+        f"embeddings saved to {directory}"
+    )
+
+
+def load_embeddings(directory: Path, mmap: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    directory = Path(directory)
+    embeddings = np.load(directory / "embeddings.npy", mmap_mode="r" if mmap else None)
+    return embeddings, np.load(directory / "components.npy")
+
+
+def neighbour_overlap(
+    normalized,
+    embeddings: np.ndarray,
+    k: int = 10,
+    n_queries: int = 200,
+    seed: int = 42,
+) -> Dict[str, float]:
+    # Fraction of the exact sparse top-k that the reduced space also returns
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(normalized.shape[0], min(n_queries, normalized.shape[0]), replace=False)
+
+    overlap, sparse_ms, dense_ms = [], [], []
+    for query_idx in queries:
+        start = time.perf_counter()
+        exact, _ = select_top_k(
+            normalized @ normalized[query_idx].toarray().ravel(), k, exclude=query_idx
+        )
+        sparse_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        reduced, _ = select_top_k(
+            score_dense(embeddings, embeddings[query_idx]), k, exclude=query_idx
+        )
+        dense_ms.append((time.perf_counter() - start) * 1000)
+
+        overlap.append(np.intersect1d(exact, reduced).size / max(len(exact), 1))
+
+    sparse_bytes = sum(getattr(normalized, name).nbytes for name in ("data", "indices", "indptr"))
+    report = {
+        "k": k,
+        "n_queries": len(queries),
+        "dim": embeddings.shape[1],
+        "dtype": str(embeddings.dtype),
+        "overlap_at_k": float(np.mean(overlap)),
+        "sparse_ms_p50": float(np.median(sparse_ms)),
+        "dense_ms_p50": float(np.median(dense_ms)),
+        "sparse_bytes": int(sparse_bytes),
+        "dense_bytes": int(embeddings.nbytes),
+    }
+    logging.info(
+        f"overlap@{k} {report['overlap_at_k']:.3f} | "
+        f"scoring p50 {report['sparse_ms_p50']:.3f} ms sparse vs "
+        f"{report['dense_ms_p50']:.3f} ms dense | "
+        f"{sparse_bytes / 1e6:.1f} MB sparse vs {embeddings.nbytes / 1e6:.1f} MB dense"
+    )
+    return report
+
+
+def save_overlap_report(report: Dict[str, float], path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
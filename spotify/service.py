@@ -0,0 +1,529 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from http import HTTPStatus
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+
+from cache import VERSION_CHECK_SECONDS, ResultCache, model_version
+from catalog import DISPLAY_COLS, load_catalog
+from content_filtering import (
+    Paths,
+    SongNotFoundError,
+    get_batch_recommendations,
+    get_top_k_recommendations,
+    load_neighbour_table,
+)
+from diversity import DIVERSITY_METHODS, Diversity
+from filters import TrackFilter, load_attribute_index
+from instrumentation import (
+    configure_logging,
+    drain_metrics,
+    enable_metrics,
+    increment,
+    metrics,
+    metrics_enabled,
+    span,
+)
+from lookup import load_song_index, normalize_key
+from matrix_store import load_csr_arrays
+from reduction import load_embeddings
+from serving import load_current_bundle
+from suggestions import build_artist_suggestions, build_song_suggestions
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 8000
+MAX_BODY_BYTES: int = 1 << 20
+MAX_BATCH_QUERIES: int = 1_000
+MAX_K: int = 100
+REQUEST_TIMEOUT: float = 10.0
+# Values the key and time_signature filters accept: the pitch classes, and the
+# meters Spotify reports
+KEY_VALUES = range(12)
+TIME_SIGNATURE_VALUES = range(3, 8)
+# Request spans are named by route; anything else is counted as unmatched
+ROUTES = frozenset(
+    (
+        "/health",
+        "/recommend",
+        "/recommend/batch",
+        "/suggest/artists",
+        "/suggest/songs",
+        "/cache/stats",
+        "/metrics",
+    )
+)
+
+# Set by the worker pool initializer; every worker maps the same matrix files
+_worker_state: Dict = {}
+
+
+def _init_worker(paths: Paths, dense: bool, instrumented: bool) -> None:
+    if instrumented:
+        enable_metrics()
+    bundle = load_current_bundle(paths, suggestions=False)
+    if bundle is not None and (bundle.embeddings is not None or not dense):
+        _worker_state["catalog"] = bundle.catalog
+        _worker_state["matrix"] = bundle.embeddings if dense else bundle.matrix
+        _worker_state["song_index"] = bundle.song_index
+        _worker_state["neighbour_table"] = bundle.neighbour_table
+        _worker_state["attribute_index"] = bundle.attribute_index
+        return
+
+    _worker_state["catalog"] = load_catalog(paths.cleaned_catalog, columns=DISPLAY_COLS)
+    if dense:
+        _worker_state["matrix"], _ = load_embeddings(paths.embeddings)
+    else:
+        _worker_state["matrix"] = load_csr_arrays(paths.normalized_arrays)
+    _worker_state["song_index"] = load_song_index(paths.song_index)
+    _worker_state["neighbour_table"] = load_neighbour_table(
+        paths.neighbour_table, _worker_state["matrix"].shape[0]
+    )
+    _worker_state["attribute_index"] = load_attribute_index(paths.attribute_index)
+
+
+def _recommend(
+    name: str,
+    artist: str,
+    k: int,
+    diversity: Optional[str] = None,
+    filters: Optional[TrackFilter] = None,
+) -> List[Dict]:
+    recommendations = get_top_k_recommendations(
+        query_name=name,
+        query_artist=artist,
+        raw_df=_worker_state["catalog"],
+        features_matrix=_worker_state["matrix"],
+        top_k=k,
+        normalized=True,
+        song_index=_worker_state["song_index"],
+        neighbour_table=_worker_state["neighbour_table"],
+        diversity=Diversity(diversity) if diversity else None,
+        filters=filters,
+        attribute_index=_worker_state["attribute_index"],
+    )
+    return recommendations.to_dict(orient="records")
+
+
+def _recommend_batch(queries: List[Tuple[str, str]], k: int) -> List[List[Dict]]:
+    batches = get_batch_recommendations(
+        [(name.lower(), artist.lower()) for name, artist in queries],
+        _worker_state["catalog"],
+        _worker_state["matrix"],
+        top_k=k,
+        song_index=_worker_state["song_index"],
+    )
+    results = []
+    for batch in batches:
+        # Rows are grouped by query in request order; rank 0 starts each group
+        bounds = np.r_[np.flatnonzero(batch["rank"].to_numpy() == 0), len(batch)]
+        rows = batch.drop(columns=["query_index", "rank"])
+        results.extend(
+            rows.iloc[start:stop].to_dict(orient="records")
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        )
+    return results
+
+
+def _run_in_worker(func, *args) -> Tuple[Any, Optional[Exception], Optional[Dict]]:
+    # Spans recorded in this worker travel back with the result or the error,
+    # so a failed call never leaves them to be reported with a later request
+    try:
+        result = func(*args)
+    except ValueError as e:
+        # Invalid queries, e.g. an unknown song; _score turns them into 4xx
+        return None, e, drain_metrics()
+    except Exception as e:
+        # Anything else is a bug and propagates as is, carrying its spans
+        e.worker_metrics = drain_metrics()
+        raise
+    return result, None, drain_metrics()
+
+
+class BadRequest(Exception):
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def _param(params: Dict[str, List[str]], key: str, default: Optional[str] = None) -> str:
+    values = params.get(key)
+    if values:
+        return values[0]
+    if default is None:
+        raise BadRequest(f"Missing query parameter '{key}'.")
+    return default
+
+
+def _int_param(params: Dict[str, List[str]], key: str, default: int, upper: int) -> int:
+    try:
+        value = int(_param(params, key, str(default)))
+    except ValueError:
+        raise BadRequest(f"Query parameter '{key}' must be an integer.")
+    if not 1 <= value <= upper:
+        raise BadRequest(f"Query parameter '{key}' must be between 1 and {upper}.")
+    return value
+
+
+def _number_param(params: Dict[str, List[str]], key: str, cast=float):
+    # None when absent
+    if key not in params:
+        return None
+    try:
+        return cast(params[key][0])
+    except ValueError:
+        raise BadRequest(f"Query parameter '{key}' must be a number.")
+
+
+def _track_filter(params: Dict[str, List[str]]) -> Optional[TrackFilter]:
+    # Repeated parameters (key=1&key=6) are alternatives; values are sorted so
+    # that equivalent filters share a cache entry
+    try:
+        keys = tuple(sorted({int(v) for v in params.get("key", [])}))
+        time_signatures = tuple(sorted({int(v) for v in params.get("time_signature", [])}))
+    except ValueError:
+        raise BadRequest("Query parameters 'key' and 'time_signature' must be integers.")
+    if not set(keys) <= set(KEY_VALUES):
+        raise BadRequest("Query parameter 'key' must be between 0 and 11.")
+    if not set(time_signatures) <= set(TIME_SIGNATURE_VALUES):
+        raise BadRequest("Query parameter 'time_signature' must be between 3 and 7.")
+    tempo_window = _number_param(params, "tempo_window")
+    if tempo_window is not None and tempo_window < 0:
+        raise BadRequest("Query parameter 'tempo_window' must not be negative.")
+
+    track_filter = TrackFilter(
+        year_min=_number_param(params, "year_min", int),
+        year_max=_number_param(params, "year_max", int),
+        keys=keys,
+        time_signatures=time_signatures,
+        tempo_min=_number_param(params, "tempo_min"),
+        tempo_max=_number_param(params, "tempo_max"),
+        tempo_window=tempo_window,
+        artists=tuple(sorted({normalize_key(v) for v in params.get("only_artist", [])})),
+        exclude_artists=tuple(
+            sorted({normalize_key(v) for v in params.get("exclude_artist", [])})
+        ),
+        exclude_track_ids=tuple(sorted(set(params.get("exclude", [])))),
+    )
+    return None if track_filter == TrackFilter() else track_filter
+
+
+class RecommenderService:
+    def __init__(
+        self,
+        paths: Optional[Paths] = None,
+        n_workers: Optional[int] = None,
+        cache_dir: Optional[Path] = None,
+        dense: bool = False,
+    ):
+        self.paths = paths = paths or Paths()
+        self.n_workers = n_workers or os.cpu_count()
+        self.dense = dense
+        # Dropped only once the state below has been reloaded, so results are
+        # never cached under a version the service is not serving yet
+        self.cache = ResultCache(paths.model_artifacts, disk_dir=cache_dir, watch=False)
+        self.pool = None
+        self._load()
+
+    def _load(self) -> None:
+        # Suggestions are cheap lookups served on the event loop; scoring goes
+        # to worker processes that each load the artifacts once at start-up.
+        # The version is read first: a rebuild during loading triggers another
+        version = model_version(self.paths.model_artifacts)
+        paths = self.paths
+        bundle = load_current_bundle(paths)
+        if bundle is not None:
+            self.artist_suggestions = bundle.artist_suggestions
+            self.song_suggestions = bundle.song_suggestions
+            # Resolving the track here keys cached results by catalog row
+            self.song_index = bundle.song_index
+            self.filterable = bundle.attribute_index is not None
+        else:
+            catalog = load_catalog(paths.cleaned_catalog, columns=DISPLAY_COLS)
+            self.artist_suggestions = build_artist_suggestions(catalog)
+            self.song_suggestions = build_song_suggestions(catalog)
+            self.song_index = load_song_index(paths.song_index)
+            self.filterable = load_attribute_index(paths.attribute_index) is not None
+        retired = self.pool
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            initializer=_init_worker,
+            initargs=(paths, self.dense, metrics_enabled()),
+        )
+        if retired is not None:
+            # Requests already queued on the old workers still finish there
+            retired.shutdown(wait=False)
+        self.version = version
+        self.cache.set_version(version)
+        self._version_checked = time.monotonic()
+
+    def _refresh(self) -> None:
+        # Reloads the song index, suggestions and worker pool after a rebuild
+        # or ingest changed the artifacts; checked at most once a second
+        now = time.monotonic()
+        if now - self._version_checked < VERSION_CHECK_SECONDS:
+            return
+        self._version_checked = now
+        if model_version(self.paths.model_artifacts) == self.version:
+            return
+        logging.info(f"Model artifacts changed since {self.version}; reloading")
+        try:
+            self._load()
+        except Exception:
+            # Typically artifacts caught mid-rebuild; retried at the next check
+            logging.exception("Reload failed; still serving the previous version")
+
+    async def _score(self, func, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            result, error, worker_metrics = await loop.run_in_executor(
+                self.pool, _run_in_worker, func, *args
+            )
+        except Exception as e:
+            if getattr(e, "worker_metrics", None) is not None:
+                metrics.merge(e.worker_metrics)
+            raise
+        if worker_metrics is not None:
+            metrics.merge(worker_metrics)
+        if isinstance(error, SongNotFoundError):
+            raise BadRequest(str(error), HTTPStatus.NOT_FOUND)
+        if error is not None:
+            raise BadRequest(str(error))
+        return result
+
+    async def route(self, method: str, path: str, params: Dict, body: bytes):
+        if method == "GET" and path == "/health":
+            return {"status": "ok"}
+        self._refresh()
+
+        if method == "GET" and path == "/recommend":
+            k = _int_param(params, "k", 10, MAX_K)
+            name, artist = _param(params, "name"), _param(params, "artist")
+            diversity = _param(params, "diversity", "") or None
+            if diversity is not None and diversity not in DIVERSITY_METHODS:
+                raise BadRequest(
+                    f"Query parameter 'diversity' must be one of {', '.join(DIVERSITY_METHODS)}."
+                )
+            track_filter = _track_filter(params)
+            if track_filter is not None and not self.filterable:
+                raise BadRequest(
+                    "Filtered queries need the attribute index; build it with filters.py.",
+                    HTTPStatus.SERVICE_UNAVAILABLE,
+                )
+            query_idx = self.song_index.find(name, artist)
+            if query_idx is None:
+                raise BadRequest(f"Song '{name}' by '{artist}' not found.", HTTPStatus.NOT_FOUND)
+
+            key = ("recommend", query_idx, k, diversity, track_filter)
+            recommendations = self.cache.get(key)
+            if recommendations is None:
+                version = self.version
+                recommendations = await self._score(
+                    _recommend, name, artist, k, diversity, track_filter
+                )
+                # A reload while scoring makes query_idx and the result stale
+                if self.version == version:
+                    self.cache.put(key, recommendations)
+            return {"recommendations": recommendations}
+
+        if method == "POST" and path == "/recommend/batch":
+            try:
+                payload = json.loads(body or b"{}")
+                queries = [(str(name), str(artist)) for name, artist in payload["queries"]]
+                k = int(payload.get("k", 10))
+            except (ValueError, KeyError, TypeError):
+                raise BadRequest('Body must be {"queries": [[name, artist], ...], "k": int}.')
+            if not queries or len(queries) > MAX_BATCH_QUERIES or not 1 <= k <= MAX_K:
+                raise BadRequest(
+                    f"Send 1 to {MAX_BATCH_QUERIES} queries and k between 1 and {MAX_K}."
+                )
+            return {"recommendations": await self._score(_recommend_batch, queries, k)}
+
+        if method == "GET" and path == "/suggest/artists":
+            limit = _int_param(params, "limit", 10, MAX_K)
+            query = normalize_key(_param(params, "q"))
+            suggestions = self.cache.get_or_compute(
+                ("artists", query, limit), lambda: self.artist_suggestions.suggest(query, limit)
+            )
+            return {"suggestions": suggestions}
+
+        if method == "GET" and path == "/suggest/songs":
+            limit = _int_param(params, "limit", 10, MAX_K)
+            query = normalize_key(_param(params, "q"))
+            artist = normalize_key(_param(params, "artist"))
+            suggestions = self.cache.get_or_compute(
+                ("songs", query, artist, limit),
+                lambda: self.song_suggestions.suggest(query, limit, scope=artist),
+            )
+            return {"suggestions": suggestions}
+
+        if method == "GET" and path == "/cache/stats":
+            return self.cache.stats()
+
+        if method == "GET" and path == "/metrics":
+            return {**metrics.snapshot(), "cache": self.cache.stats()}
+
+        raise BadRequest(f"No route for {method} {path}.", HTTPStatus.NOT_FOUND)
+
+    async def respond(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        route = url.path if url.path in ROUTES else "unmatched"
+        with span(f"http {route}"):
+            try:
+                status, payload = (
+                    HTTPStatus.OK,
+                    await self.route(method, url.path, parse_qs(url.query), body),
+                )
+            except BadRequest as e:
+                status, payload = e.status, {"error": str(e)}
+            except Exception:
+                logging.exception(f"{method} {target} failed")
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error."}
+        increment(f"http {route} {status.value}")
+        return status, payload
+
+    async def handle_connection(self, reader, writer) -> None:
+        # Minimal HTTP/1.1 with keep-alive; one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length > MAX_BODY_BYTES:
+                    # The unread body would desync the connection, so close it
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Too large."}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.respond(method, target, body)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f"Recommendation service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+@dataclass(frozen=True, slots=True)
+class RecommenderClient:
+    base_url: str
+    timeout: float = REQUEST_TIMEOUT
+
+    def _request(
+        self,
+        path: str,
+        params: Optional[Dict] = None,
+        body: Optional[Dict] = None,
+        doseq: bool = False,
+    ):
+        url = f"{self.base_url.rstrip('/')}{path}"
+        if params:
+            url += "?" + urlencode(params, doseq=doseq)
+        data = json.dumps(body).encode() if body is not None else None
+        request = Request(url, data=data, headers={"Content-Type": "application/json"})
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def recommend(
+        self,
+        name: str,
+        artist: str,
+        k: int = 10,
+        diversity: Optional[str] = None,
+        filters: Optional[Dict] = None,
+    ) -> Optional[pd.DataFrame]:
+        # None when the song is not in the catalog. filters holds the /recommend
+        # filter parameters, lists for the repeatable ones: {"key": [0, 7]}
+        params = {"name": name, "artist": artist, "k": k, **(filters or {})}
+        if diversity:
+            params["diversity"] = diversity
+        try:
+            payload = self._request("/recommend", params, doseq=True)
+        except HTTPError as e:
+            if e.code == HTTPStatus.NOT_FOUND:
+                return None
+            raise
+        return pd.DataFrame(payload["recommendations"], columns=DISPLAY_COLS)
+
+    def suggest_artists(self, query: str, limit: int = 10) -> List[str]:
+        return self._request("/suggest/artists", {"q": query, "limit": limit})["suggestions"]
+
+    def suggest_songs(self, query: str, artist: str, limit: int = 10) -> List[str]:
+        params = {"q": query, "artist": artist, "limit": limit}
+        return self._request("/suggest/songs", params)["suggestions"]
+
+    def metrics(self) -> Dict:
+        return self._request("/metrics")
+
+
+def main(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    n_workers: Optional[int] = None,
+    cache_dir: Optional[Path] = None,
+    dense: bool = False,
+    instrumented: bool = False,
+):
+    if instrumented:
+        enable_metrics()
+    service = RecommenderService(n_workers=n_workers, cache_dir=cache_dir, dense=dense)
+    try:
+        asyncio.run(service.serve(host, port))
+    finally:
+        service.pool.shutdown()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Serve recommendations over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--cache-dir", type=Path, default=None, help="shared on-disk result cache for all workers"
+    )
+    parser.add_argument(
+        "--dense", action="store_true", help="score with the reduced dense embeddings"
+    )
+    parser.add_argument(
+        "--metrics", action="store_true", help="record stage timings, served at /metrics"
+    )
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.workers, args.cache_dir, args.dense, args.metrics)
@@ -0,0 +1,200 @@
+import argparse
+from dataclasses import dataclass
+import json
+import logging
+from pathlib import Path
+import pickle
+import shutil
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from scipy.sparse import csr_matrix
+
+from cache import model_version
+from catalog import DISPLAY_COLS, load_catalog
+from content_filtering import NeighbourTable, Paths, load_neighbour_table
+from filters import AttributeIndex, load_attribute_index
+from instrumentation import configure_logging
+from lookup import (
+    HashedSongIndex,
+    build_song_index,
+    hash_song_index,
+    load_hashed_song_index,
+    save_hashed_song_index,
+)
+from matrix_store import load_csr_arrays, replace_atomically
+from suggestions import SuggestionIndex, build_artist_suggestions, build_song_suggestions
+
+# Bumped whenever the layout below changes; older bundles must be rebuilt
+BUNDLE_FORMAT: int = 1
+
+# Bundle layout, everything memory-mappable except the suggestion indexes
+MANIFEST = "manifest.json"
+CATALOG = "catalog.arrow"
+SONG_INDEX = "song_index"
+SUGGESTIONS = "suggestions.pkl"
+MATRIX = "matrix"
+EMBEDDINGS = "embeddings.npy"
+NEIGHBOURS = "neighbours"
+ATTRIBUTES = "attributes"
+
+
+@dataclass(frozen=True, slots=True)
+class ServingBundle:
+    catalog: pd.DataFrame
+    matrix: csr_matrix
+    song_index: HashedSongIndex
+    manifest: Dict
+    embeddings: Optional[np.ndarray] = None
+    neighbour_table: Optional[NeighbourTable] = None
+    attribute_index: Optional[AttributeIndex] = None
+    artist_suggestions: Optional[SuggestionIndex] = None
+    song_suggestions: Optional[SuggestionIndex] = None
+
+
+def build_serving_bundle(paths: Optional[Paths] = None) -> Dict:
+    # Everything serving needs, derived from the training artifacts and
+    # written to a scratch directory that replaces the old bundle at the end
+    paths = paths or Paths()
+    start = time.perf_counter()
+    directory = paths.serving_bundle
+    with replace_atomically(directory) as scratch:
+        scratch.mkdir(parents=True)
+        manifest = _write_bundle(paths, scratch)
+
+    size_mb = sum(manifest["files"].values()) / 1e6
+    logging.info(
+        f"Serving bundle {manifest['version']} ({manifest['n_rows']} tracks, {size_mb:.1f} MB) "
+        f"written to {directory} in {time.perf_counter() - start:.1f}s"
+    )
+    return manifest
+
+
+def _write_bundle(paths: Paths, scratch: Path) -> Dict:
+    version = model_version(paths.model_artifacts)
+    catalog = load_catalog(paths.cleaned_catalog, columns=DISPLAY_COLS)
+    # Plain (not dictionary) strings, uncompressed: reads are a memory map.
+    # Missing values become "" since Arrow-backed nulls read back as pd.NA,
+    # which is ambiguous in the app's truthiness checks
+    table = pa.Table.from_pandas(catalog.astype(object).fillna(""), preserve_index=False)
+    feather.write_feather(table, scratch / CATALOG, compression="uncompressed")
+
+    save_hashed_song_index(hash_song_index(build_song_index(catalog)), scratch / SONG_INDEX)
+    with open(scratch / SUGGESTIONS, "wb") as f:
+        suggestions = (build_artist_suggestions(catalog), build_song_suggestions(catalog))
+        pickle.dump(suggestions, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    matrix = load_csr_arrays(paths.normalized_arrays)
+    if matrix.shape[0] != len(catalog):
+        raise ValueError(
+            f"Feature matrix has {matrix.shape[0]} rows but the catalog has {len(catalog)}."
+        )
+    shutil.copytree(paths.normalized_arrays, scratch / MATRIX)
+    if (paths.embeddings / "embeddings.npy").exists():
+        shutil.copy2(paths.embeddings / "embeddings.npy", scratch / EMBEDDINGS)
+    if load_neighbour_table(paths.neighbour_table, matrix.shape[0]) is not None:
+        shutil.copytree(paths.neighbour_table, scratch / NEIGHBOURS)
+    if paths.attribute_index.exists():
+        shutil.copytree(paths.attribute_index, scratch / ATTRIBUTES)
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "n_rows": len(catalog),
+        "n_features": matrix.shape[1],
+        "files": {
+            str(path.relative_to(scratch)): path.stat().st_size
+            for path in sorted(scratch.rglob("*"))
+            if path.is_file()
+        },
+    }
+    with open(scratch / MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_serving_bundle(directory: Path, suggestions: bool = True) -> ServingBundle:
+    # Scoring workers skip the suggestion indexes, the only part that is unpickled
+    directory = Path(directory)
+    with open(directory / MANIFEST) as f:
+        manifest = json.load(f)
+    if manifest["format"] != BUNDLE_FORMAT:
+        raise ValueError(
+            f"Bundle format {manifest['format']} is not {BUNDLE_FORMAT}; rebuild the bundle."
+        )
+
+    # Arrow-backed string columns wrap the mapped buffers without copying
+    table = feather.read_table(directory / CATALOG, memory_map=True)
+    catalog = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    artist_suggestions = song_suggestions = None
+    if suggestions:
+        with open(directory / SUGGESTIONS, "rb") as f:
+            artist_suggestions, song_suggestions = pickle.load(f)
+
+    embeddings_path = directory / EMBEDDINGS
+    return ServingBundle(
+        catalog=catalog,
+        matrix=load_csr_arrays(directory / MATRIX),
+        song_index=load_hashed_song_index(directory / SONG_INDEX),
+        manifest=manifest,
+        embeddings=np.load(embeddings_path, mmap_mode="r") if embeddings_path.exists() else None,
+        neighbour_table=load_neighbour_table(directory / NEIGHBOURS, manifest["n_rows"]),
+        attribute_index=load_attribute_index(directory / ATTRIBUTES),
+        artist_suggestions=artist_suggestions,
+        song_suggestions=song_suggestions,
+    )
+
+
+def load_current_bundle(
+    paths: Optional[Paths] = None, suggestions: bool = True
+) -> Optional[ServingBundle]:
+    # None when there is no bundle or it predates the current model artifacts,
+    # in which case callers load the artifacts individually
+    paths = paths or Paths()
+    manifest_path = paths.serving_bundle / MANIFEST
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        logging.warning(f"Serving bundle in {paths.serving_bundle} has an old format; ignoring it")
+        return None
+    if manifest["version"] != model_version(paths.model_artifacts):
+        logging.warning(
+            f"Serving bundle in {paths.serving_bundle} is stale; rebuild it with serving.py"
+        )
+        return None
+    return load_serving_bundle(paths.serving_bundle, suggestions)
+
+
+def main(check: bool = False):
+    paths = Paths()
+    if not check:
+        build_serving_bundle(paths)
+
+    # Cold start of a scoring worker, which skips the suggestion indexes
+    start = time.perf_counter()
+    bundle = load_current_bundle(paths, suggestions=False)
+    if bundle is None:
+        raise SystemExit(f"No current serving bundle in {paths.serving_bundle}.")
+    logging.info(
+        f"Worker cold start: {(time.perf_counter() - start) * 1000:.1f} ms for "
+        f"{bundle.manifest['n_rows']} tracks (bundle {bundle.manifest['version']})"
+    )
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Build the prebuilt serving bundle.")
+    parser.add_argument(
+        "--check", action="store_true", help="only time loading the existing bundle"
+    )
+    args = parser.parse_args()
+
+    main(check=args.check)
@@ -0,0 +1,106 @@
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from lookup import normalize_key
+
+MIN_QUERY_LENGTH: int = 2
+NGRAM_SIZE: int = 2
+
+# Separates the scope (e.g. artist) from the suggested term inside a key; it
+# sorts below every printable character, so each scope is one contiguous run
+SCOPE_SEP: str = "\x1f"
+
+
+def _ngrams(text: str) -> set:
+    return {text[i : i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+@dataclass(frozen=True, slots=True)
+class SuggestionIndex:
+    # Sorted "scope<SEP>term" keys and the term part of each key
+    keys: List[str]
+    terms: List[str]
+    # n-gram -> sorted positions in keys whose term contains it
+    postings: Dict[str, np.ndarray]
+
+    def _scope_bounds(self, scope: str):
+        base = normalize_key(scope) + SCOPE_SEP
+        lo = bisect_left(self.keys, base)
+        hi = bisect_left(self.keys, base[:-1] + chr(ord(SCOPE_SEP) + 1), lo)
+        return base, lo, hi
+
+    def _substring_candidates(self, query: str, lo: int, hi: int) -> np.ndarray:
+        grams = _ngrams(query)
+        if any(gram not in self.postings for gram in grams):
+            return np.empty(0, dtype=np.int32)
+
+        # Intersect the rarest posting lists first to shrink the candidates fast
+        lists = sorted((self.postings[gram] for gram in grams), key=len)
+        candidates = lists[0][np.searchsorted(lists[0], lo) : np.searchsorted(lists[0], hi)]
+        for posting in lists[1:]:
+            if candidates.size == 0:
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        return candidates
+
+    def suggest(self, query: str, limit: int = 10, scope: str = "") -> List[str]:
+        query = normalize_key(query)
+        if len(query) < MIN_QUERY_LENGTH:
+            return []
+        base, lo, hi = self._scope_bounds(scope)
+
+        # Exact-prefix matches come first, in sorted order
+        matches = []
+        prefix = base + query
+        pos = bisect_left(self.keys, prefix, lo, hi)
+        while pos < hi and len(matches) < limit and self.keys[pos].startswith(prefix):
+            matches.append(self.terms[pos])
+            pos += 1
+        if len(matches) >= limit:
+            return matches
+
+        # Then substring matches, ranked by how early the query appears
+        contains = []
+        for pos in self._substring_candidates(query, lo, hi):
+            term = self.terms[pos]
+            offset = term.find(query)
+            if offset > 0:
+                contains.append((offset, len(term), term))
+        contains.sort()
+        matches.extend(term for _, _, term in contains[: limit - len(matches)])
+        return matches
+
+
+def build_suggestion_index(
+    terms: pd.Series,
+    scopes: Optional[pd.Series] = None,
+) -> SuggestionIndex:
+    terms = terms.astype(object).fillna("").map(normalize_key)
+    scopes = scopes.astype(object).fillna("").map(normalize_key) if scopes is not None else ""
+    keys = sorted(set(scopes + SCOPE_SEP + terms))
+    key_terms = [key.split(SCOPE_SEP, 1)[1] for key in keys]
+
+    postings = defaultdict(list)
+    for pos, term in enumerate(key_terms):
+        for gram in _ngrams(term):
+            postings[gram].append(pos)
+
+    return SuggestionIndex(
+        keys,
+        key_terms,
+        {gram: np.asarray(positions, dtype=np.int32) for gram, positions in postings.items()},
+    )
+
+
+def build_artist_suggestions(df: pd.DataFrame) -> SuggestionIndex:
+    return build_suggestion_index(df["artist"])
+
+
+def build_song_suggestions(df: pd.DataFrame) -> SuggestionIndex:
+    # Songs are scoped by artist so each artist's titles form one sorted run
+    return build_suggestion_index(df["name"], scopes=df["artist"])
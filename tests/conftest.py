@@ -0,0 +1,6 @@
+from pathlib import Path
+import sys
+
+# The scripts in spotify/ import their siblings by bare name, as when run from
+# that directory
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "spotify"))
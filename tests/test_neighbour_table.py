@@ -0,0 +1,46 @@
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from scipy.sparse import random as sparse_random
+
+from content_filtering import compute_neighbour_table, extend_neighbour_table, normalize_rows
+from matrix_store import save_csr_arrays
+
+
+def _catalog(n_rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    features = sparse_random(n_rows, 40, density=0.3, random_state=seed).toarray()
+    # Tracks 6-17 are near duplicates of track 5 whose cosine to it rounds to
+    # 1.0 in float16, more of them than the table is wide
+    features[6:18] = features[5] * (1 + rng.normal(0, 0.01, (12, 40)))
+    return csr_matrix(features)
+
+
+def test_extended_table_matches_rebuild(tmp_path):
+    old = _catalog(300)
+    # Re-ingest the first 20 tracks with their features off by float noise,
+    # so each copy scores just under 1.0 against its original
+    noise = np.random.default_rng(1).normal(0, 1e-5, (20, old.shape[1]))
+    features = vstack([old, old[:20].multiply(1 + noise)], format="csr")
+    normalized, _ = normalize_rows(features)
+    n_old = old.shape[0]
+
+    save_csr_arrays(normalized[:n_old], tmp_path / "old")
+    save_csr_arrays(normalized, tmp_path / "full")
+    stored = compute_neighbour_table(tmp_path / "old", k=10, n_workers=1)
+    extended = extend_neighbour_table(stored, normalized)
+    rebuilt = compute_neighbour_table(tmp_path / "full", k=10, n_workers=1)
+
+    assert extended.indices.shape == rebuilt.indices.shape
+    np.testing.assert_allclose(
+        extended.scores.astype(np.float32), rebuilt.scores.astype(np.float32), atol=1e-3
+    )
+    # Tied neighbours may come back in either order, but every neighbour that
+    # strictly beats the last kept score must be found by both
+    for row in range(len(rebuilt.indices)):
+        cutoff = rebuilt.scores[row, -1]
+        assert set(rebuilt.indices[row][rebuilt.scores[row] > cutoff]) <= set(
+            extended.indices[row]
+        )
+    # The fresh copy of track 5 outranks its stored near duplicates, though
+    # all of them were stored as 1.0
+    assert extended.indices[5, 0] == n_old + 5